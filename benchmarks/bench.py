@@ -0,0 +1,265 @@
+"""Benchmark the listing, caching and preview hot paths.
+
+    python benchmarks/bench.py --depth 5 --fanout 5 --files 5 --out results.json
+    python benchmarks/bench.py --compare results.json
+
+Results are written as JSON so runs can be compared across releases, a
+``--compare`` run prints the ratio of every timing to the given file.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_tree import generate_tree  # noqa: E402
+
+
+def _quiet_streamlit():
+    # handlers run outside of ``streamlit run``, silence the bare mode warnings
+    import streamlit.logger
+
+    streamlit.logger.set_log_level("error")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+
+def timed(func, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {"seconds": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def bench_listing(sfb, root, repeat, workers=8):
+    from streamlit_file_browser.tree import CACHE_FILE_NAME
+
+    results = {}
+    cache_path = os.path.join(root, CACHE_FILE_NAME)
+
+    def cold():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        sfb.ensure_tree_cache(root, use_cache=True, limit=10**9)
+
+    results["listing.walk"] = timed(lambda: sfb.ensure_tree_cache(root, limit=10**9), repeat)
+    results["listing.walk_parallel"] = timed(
+        lambda: sfb.ensure_tree_cache(root, limit=10**9, workers=workers), repeat
+    )
+    results["listing.walk_parallel"]["workers"] = workers
+    results["listing.cache_cold"] = timed(cold, repeat)
+    results["listing.cache_warm"] = timed(
+        lambda: sfb.ensure_tree_cache(root, use_cache=True, limit=10**9), repeat
+    )
+    sfb.ensure_tree_cache(root, use_shared_cache=True, limit=10**9)
+    results["listing.shared_hit"] = timed(
+        lambda: sfb.ensure_tree_cache(root, use_shared_cache=True, limit=10**9), repeat
+    )
+    sfb.invalidate_tree_cache(root)
+
+    sfb.search_tree(root, "file_1")
+    results["search.index_query"] = timed(lambda: sfb.search_tree(root, "file_1", limit=100), repeat)
+
+    files = sfb.ensure_tree_cache(root, limit=10**9)
+    payload = {}
+    results["payload.json_encode"] = timed(lambda: payload.update(data=json.dumps(files)), repeat)
+    results["payload.json_encode"].update(
+        files=len(files), bytes=len(payload["data"].encode("utf-8"))
+    )
+
+    listing = sfb.ensure_tree_listing(root, limit=10**9)
+    results["payload.json_encode_columnar"] = timed(
+        lambda: payload.update(data=json.dumps(listing.to_payload())), repeat
+    )
+    results["payload.json_encode_columnar"].update(
+        files=len(listing), bytes=len(payload["data"].encode("utf-8")), listing_bytes=listing.nbytes
+    )
+    results["listing.query_topk"] = timed(
+        lambda: listing.query("-update_time", search="file_1", limit=100), repeat
+    )
+    return results
+
+
+def _write_lines(path, lines):
+    with open(path, "w") as f:
+        f.writelines(f"{line}\n" for line in lines)
+
+
+def generate_preview_inputs(directory, rows):
+    """Write one large sample per previewable extension, return ``{ext: name}``."""
+    rng = random.Random(0)
+    samples = {}
+
+    def sample(ext, writer):
+        name = f"sample{ext}"
+        writer(os.path.join(directory, name))
+        samples[ext] = name
+
+    table = [",".join(f"{rng.random():.6f}" for _ in range(8)) for _ in range(rows)]
+    sample(".csv", lambda p: _write_lines(p, ["a,b,c,d,e,f,g,h"] + table))
+    sample(".tsv", lambda p: _write_lines(p, ["a\tb\tc\td\te\tf\tg\th"] + [r.replace(",", "\t") for r in table]))
+    text = [f"{i:08d} INFO step={i} loss={rng.random():.6f}" for i in range(rows)]
+    for ext in (".log", ".txt", ".md", ".upf", ".UPF", ".orb", ".py", ".sh"):
+        sample(ext, lambda p: _write_lines(p, text))
+    sample(".json", lambda p: json.dump([{"step": i, "loss": rng.random()} for i in range(rows)], open(p, "w")))
+    sample(".html", lambda p: _write_lines(p, ["<html><body>"] + [f"<p>{t}</p>" for t in text] + ["</body></html>"]))
+    sample(".htm", lambda p: shutil.copy(os.path.join(directory, "sample.html"), p))
+    atoms = [
+        f"ATOM  {i % 100000:5d}  CA  ALA A{i % 10000:4d}    "
+        f"{rng.uniform(-50, 50):8.3f}{rng.uniform(-50, 50):8.3f}{rng.uniform(-50, 50):8.3f}"
+        "  1.00  0.00           C"
+        for i in range(rows)
+    ]
+    sample(".pdb", lambda p: _write_lines(p, atoms + ["END"]))
+    sample(".xyz", lambda p: _write_lines(p, [str(rows), "bench"] + [f"C {rng.random():.4f} {rng.random():.4f} {rng.random():.4f}" for _ in range(rows)]))
+    sample(".gro", lambda p: _write_lines(
+        p,
+        ["bench", str(rows)]
+        + [
+            f"{i % 100000:5d}ALA     CA{i % 100000:5d}{rng.uniform(0, 9):8.3f}{rng.uniform(0, 9):8.3f}{rng.uniform(0, 9):8.3f}"
+            for i in range(rows)
+        ]
+        + ["   9.00000   9.00000   9.00000"],
+    ))
+    sample(".dbn", lambda p: _write_lines(p, [">bench", "GGGAAACCC" * 10, "(((...)))" * 10]))
+    sample(".pdf", lambda p: open(p, "wb").write(b"%PDF-1.4\n" + os.urandom(rows * 64) + b"\n%%EOF\n"))
+    return samples
+
+
+def bench_previews(sfb, directory, rows, repeat):
+    results = {}
+    samples = generate_preview_inputs(directory, rows)
+    for ext, handler in sorted(sfb.PREVIEW_HANDLERS.items()):
+        name = f"preview{ext}"
+        if ext not in samples:
+            results[name] = {"skipped": "no synthetic input for this format"}
+            continue
+
+        # the html handler rewrites links relative to the file's url
+        url = f"http://localhost/artifacts/{samples[ext]}" if ext in (".html", ".htm") else None
+
+        def run():
+            handler(directory, samples[ext], url)
+
+        def cold():
+            sfb.preview_cache.clear()
+            run()
+
+        try:
+            results[name] = timed(cold, repeat)
+            results[name]["warm"] = timed(run, repeat)["seconds"]
+            results[name]["bytes"] = os.path.getsize(os.path.join(directory, samples[ext]))
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+    return results
+
+
+# preview back ends that must not be imported with the package
+_LAZY_MODULES = ("streamlit_ace", "streamlit_molstar", "streamlit_embeded", "binaryornot", "filetype", "mrcfile")
+_IMPORT_SCRIPT = """
+import sys, json, time
+import streamlit
+start = time.perf_counter()
+import streamlit_file_browser
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [m for m in %r if m in sys.modules]]))
+"""
+
+
+def bench_import(repeat):
+    # a fresh interpreter per run, streamlit is imported first as in an app
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    runs, loaded = [], []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SCRIPT % (_LAZY_MODULES,)],
+            cwd=root, capture_output=True, text=True, check=True,
+        ).stdout
+        seconds, loaded = json.loads(out.splitlines()[-1])
+        runs.append(seconds)
+    return {
+        "import.streamlit_file_browser": {
+            "seconds": min(runs), "median": statistics.median(runs), "runs": runs, "eager_backends": loaded,
+        }
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"{'benchmark':<32} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in sorted(results.items()):
+        old = baseline.get(name, {})
+        if "seconds" not in result or "seconds" not in old:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        print(f"{name:<32} {old['seconds']:>10.4f} {result['seconds']:>10.4f} {ratio:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=5)
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--file-size", type=int, default=12)
+    parser.add_argument("--preview-rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8, help="threads of the parallel walk")
+    parser.add_argument("--skip-previews", action="store_true")
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", help="print ratios against a previous results file")
+    args = parser.parse_args()
+
+    _quiet_streamlit()
+    import streamlit_file_browser as sfb
+
+    _quiet_streamlit()
+    workdir = tempfile.mkdtemp(prefix="st-file-browser-bench-")
+    try:
+        tree = os.path.join(workdir, "tree")
+        n_dirs, n_files = generate_tree(tree, args.depth, args.fanout, args.files, args.file_size)
+        results = bench_listing(sfb, tree, args.repeat, args.workers)
+        results.update(bench_import(args.repeat))
+        if not args.skip_previews:
+            previews = os.path.join(workdir, "previews")
+            os.makedirs(previews)
+            results.update(bench_previews(sfb, previews, args.preview_rows, args.repeat))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tree": {"dirs": n_dirs, "files": n_files, **{k: getattr(args, k) for k in ("depth", "fanout", "files", "file_size")}},
+            "preview_rows": args.preview_rows,
+            "repeat": args.repeat,
+        },
+        "results": results,
+        "metrics": sfb.metrics.snapshot(),
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    else:
+        for name, result in sorted(results.items()):
+            summary = f"{result['seconds']:.4f}s" if "seconds" in result else next(iter(result.values()))
+            print(f"{name:<32} {summary}")
+
+
+if __name__ == "__main__":
+    main()
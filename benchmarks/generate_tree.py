@@ -0,0 +1,53 @@
+"""Generate synthetic artifact trees for the benchmarks.
+
+A configurable version of ``example_artifacts/static_file_server/index.py``:
+
+    python benchmarks/generate_tree.py /tmp/tree --depth 5 --fanout 5 --files 5
+"""
+import os
+import random
+import argparse
+from pathlib import Path
+
+SUFFIXES = ("csv", "txt", "pdb", "json", "log")
+
+
+def generate_tree(root, depth=5, fanout=5, files=5, file_size=12, suffixes=SUFFIXES, seed=0):
+    """Create ``fanout`` directories per level, ``depth`` levels deep, with
+    ``files`` files of ``file_size`` bytes in every directory.
+
+    Returns ``(n_dirs, n_files)``.
+    """
+    rng = random.Random(seed)
+    payload = (b"Hello World!\n" * (file_size // 13 + 1))[:file_size]
+    n_dirs = n_files = 0
+    stack = [(Path(root), depth)]
+    while stack:
+        parent, level = stack.pop()
+        parent.mkdir(parents=True, exist_ok=True)
+        n_dirs += 1
+        for i in range(files):
+            (parent / f"file_{i}.{rng.choice(suffixes)}").write_bytes(payload)
+            n_files += 1
+        if level > 1:
+            stack.extend((parent / f"dir_{i}_{level}", level - 1) for i in range(fanout))
+    return n_dirs, n_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root")
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=5)
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--file-size", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    n_dirs, n_files = generate_tree(
+        os.path.abspath(args.root), args.depth, args.fanout, args.files, args.file_size, seed=args.seed
+    )
+    print(f"generated {n_dirs} directories and {n_files} files under {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,4 +25,10 @@ setuptools.setup(
         "streamlit >= 0.63",
         "pymatgen",
     ],
+    extras_require={
+        # thumbnails of images, PDFs need pypdfium2 and videos ffmpeg
+        "thumbnails": ["Pillow", "pypdfium2"],
+        # file system events for use_watcher, it polls without
+        "watch": ["watchdog"],
+    },
 )
@@ -1,42 +1,74 @@
 import os
 import re
-import json
 import os.path
 import pathlib
 import copy
-from wcmatch import glob
 from urllib.parse import urljoin
 from html import escape
 from base64 import b64encode
 import urllib
+import secrets
+import threading
 from functools import partial
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-from binaryornot.check import is_binary
-from filetype import image_match, video_match, audio_match
 import streamlit as st
-import numpy as np
 import streamlit.components.v1 as components
-from streamlit_ace import st_ace
-from streamlit_molstar import st_molstar, st_molstar_remote
-from streamlit_molstar.auto import st_molstar_auto
-from streamlit_embeded import st_embeded
+
+from .metrics import MetricsRegistry, metrics
+from .archive import archive_entries, write_tar, write_zip
+from .conversions import ConversionService, Converter, get_conversion_service
+from .cache import ListingCache, PreviewCache, preview_cache, shared_listing_cache
+from .server import FileServer, add_upload_listener, get_file_server, serve_files
+from .sniff import FileSniff, sniff_file, sniff_files
+from .textview import read_lines, read_tail
+from .thumbnails import (
+    PREVIEW_IMAGE_EXTENSIONS,
+    PREVIEW_IMAGE_MIN_BYTES,
+    PREVIEW_IMAGE_SIZE,
+    PREVIEW_IMAGE_TIMEOUT,
+    ThumbnailService,
+    get_thumbnail_service,
+    thumbnail_extensions,
+)
+from .trajectory import PREVIEW_MIN_BYTES, preview_trajectory
+from .listing import SORT_KEYS, Listing, ListingBuilder
+from .operations import FileOperation, OperationResult, apply_operations, plan_operations
+from .previews import PreviewRegistry
+from .search import SearchIndex, invalidate_search, search_tree
+from .tree import (
+    CACHE_FILE_NAME,
+    TreeIndex,
+    cached_tree_index,
+    list_dir,
+    patch_listing,
+    walk_tree,
+)
+from .watch import stop_watching, watch_tree
 
 _DEVELOP_MODE = os.getenv("STREAMLIT_FILE_BROWSER_DEVELOP_MODE")
 # _DEVELOP_MODE = True
 
-CACHE_FILE_NAME = ".st-tree.cache"
+_component = None
 
-if _DEVELOP_MODE:
-    _component_func = components.declare_component(
-        "streamlit_file_browser",
-        url="http://localhost:3001",
-    )
-else:
-    parent_dir = os.path.dirname(os.path.abspath(__file__))
-    build_dir = os.path.join(parent_dir, "frontend/build")
-    _component_func = components.declare_component(
-        "streamlit_file_browser", path=build_dir
-    )
+
+def _component_func(**kwargs):
+    # declared on the first render, ``declare_component`` inspects every
+    # loaded module, which made up most of the import time
+    global _component
+    if _component is None:
+        if _DEVELOP_MODE:
+            _component = components.declare_component(
+                "streamlit_file_browser",
+                url="http://localhost:3001",
+            )
+        else:
+            parent_dir = os.path.dirname(os.path.abspath(__file__))
+            build_dir = os.path.join(parent_dir, "frontend/build")
+            _component = components.declare_component(
+                "streamlit_file_browser", path=build_dir
+            )
+    return _component(**kwargs)
 
 
 def render_static_file_server(
@@ -70,10 +102,64 @@ def render_static_file_server(
     return event
 
 
+PREVIEW_TEXT_LINES = 10000
+PREVIEW_TEXT_BYTES = 4 * 1024 * 1024
+
+
+def _read_text_preview(abs_path, key):
+    """Return ``(text, complete)`` for a text preview of ``abs_path``.
+
+    Files that fit in one window are returned whole. Larger ones get
+    head/tail/page controls and only the visible window is read, through
+    the mmap based ``textview`` helpers.
+    """
+    def window_at(start):
+        return preview_cache.get_or_prepare(
+            abs_path,
+            "text",
+            lambda: read_lines(abs_path, start, PREVIEW_TEXT_LINES, PREVIEW_TEXT_BYTES),
+            start=start,
+        )
+
+    window = window_at(0)
+    if window.eof and not window.truncated:
+        return window.text, True
+
+    mode = st.radio(
+        "Show", ("Head", "From line", "Tail"), horizontal=True, key=f"{key}-mode"
+    )
+    if mode == "Tail":
+        window = preview_cache.get_or_prepare(
+            abs_path,
+            "text-tail",
+            lambda: read_tail(abs_path, PREVIEW_TEXT_LINES, PREVIEW_TEXT_BYTES),
+        )
+    elif mode == "From line":
+        first_line = st.number_input(
+            "First line",
+            min_value=1,
+            value=1,
+            step=PREVIEW_TEXT_LINES,
+            key=f"{key}-line",
+        )
+        window = window_at(first_line - 1)
+    if window.first_line is None:
+        st.caption(f"Showing the last {window.lines} lines")
+    else:
+        st.caption(
+            f"Showing lines {window.first_line + 1}-{window.first_line + window.lines}"
+        )
+    if window.truncated:
+        st.warning(
+            f"Window cut at {PREVIEW_TEXT_BYTES // (1024 * 1024)} MB, lines are too long"
+        )
+    return window.text, False
+
+
 def _do_code_preview(root, file_path, url, **kwargs):
     abs_path = os.path.join(root, file_path)
-    with open(abs_path) as f:
-        st.code(f.read(), **kwargs)
+    text, _ = _read_text_preview(abs_path, f'{kwargs.get("key", abs_path)}-preview')
+    st.code(text, **kwargs)
 
 
 def _do_pdf_preview(root, file_path, url, height="420px", **kwargs):
@@ -81,77 +167,188 @@ def _do_pdf_preview(root, file_path, url, height="420px", **kwargs):
     if url:
         safe_url = escape(url)
     else:
-        with open(abs_path, "rb") as f:
-            data = b64encode(f.read()).decode("utf-8")
-        safe_url = f"data:application/pdf;base64,{data}"
+        def encode():
+            with open(abs_path, "rb") as f:
+                data = b64encode(f.read()).decode("utf-8")
+            return f"data:application/pdf;base64,{data}"
+
+        safe_url = preview_cache.get_or_prepare(abs_path, "pdf", encode)
     pdf_display = f'<iframe src="{safe_url}" width="100%" min-height="240px" height="{height} type="application/pdf"></iframe>'
     st.markdown(pdf_display, unsafe_allow_html=True)
 
 
+def _preview_trajectory_path(traj_path, key):
+    """The trajectory to preview and whether it is downsampled.
+
+    Large trajectories are previewed from a frame strided copy, cached on
+    disk, unless all frames are asked for.
+    """
+    if os.path.getsize(traj_path) < PREVIEW_MIN_BYTES:
+        return traj_path, False
+    preview = preview_trajectory(traj_path)
+    if preview.stride == 1:
+        return traj_path, False
+    if st.checkbox(f"Load all {preview.total_frames} frames", key=f"{key}-all-frames"):
+        return traj_path, False
+    st.caption(
+        f"Showing {preview.frames} of {preview.total_frames} frames, one in {preview.stride}"
+    )
+    return preview.path, True
+
+
+def _preview_image_path(image_path, key):
+    """A scaled down copy of a large image, None to show it as it is."""
+    if (
+        os.path.getsize(image_path) < PREVIEW_IMAGE_MIN_BYTES
+        or not image_path.lower().endswith(PREVIEW_IMAGE_EXTENSIONS)
+        or not image_path.lower().endswith(thumbnail_extensions())
+    ):
+        return None
+    if st.checkbox("Full resolution", key=f"{key}-full-resolution"):
+        return None
+    # rendered on the thumbnail process pool and cached on disk, the
+    # original is shown while a slow render goes on for the next rerun
+    preview = get_thumbnail_service().get(
+        image_path, PREVIEW_IMAGE_SIZE, timeout=PREVIEW_IMAGE_TIMEOUT
+    )
+    if preview:
+        st.caption(f"Scaled to {PREVIEW_IMAGE_SIZE} px")
+    return preview
+
+
 def _do_molecule_preview(root, file_path, url, **kwargs):
     use_auto = kwargs.pop("use_auto", False)
     abs_path = os.path.join(root, file_path)
     test_traj_path = os.path.splitext(abs_path)[0] + ".xtc"
+    downsampled = False
     if os.path.exists(test_traj_path):
         traj_path = test_traj_path
         traj_url = os.path.splitext(url)[0] + ".xtc" if url else None
+        if not use_auto:
+            traj_path, downsampled = _preview_trajectory_path(
+                traj_path, kwargs.get("key", traj_path)
+            )
     else:
         traj_path = None
         traj_url = None
     if use_auto:
+        from streamlit_molstar.auto import st_molstar_auto
+
         st_molstar_auto(
             [{"file": url, "local": abs_path} if url else abs_path], **kwargs
         )
     else:
-        if url:
+        from streamlit_molstar import st_molstar, st_molstar_remote
+
+        # the downsampled copy is local, it is small enough for the websocket
+        if url and not downsampled:
             st_molstar_remote(url, traj_url, **kwargs)
         else:
             st_molstar(abs_path, traj_path, **kwargs)
     return True
 
 
-def _do_csv_preview(root, file_path, url, **kwargs):
-    abs_path = os.path.join(root, file_path)
-    import pandas as pd
+PREVIEW_TABLE_ROWS = 1000
 
-    df = pd.read_csv(abs_path)
-    mask = df.applymap(type) != bool
-    d = {True: "True", False: "False"}
-    df = df.where(mask, df.replace(d))
-    df = df.replace(np.nan, None)
-    st.dataframe(df, **kwargs)
-    return True
 
+def _read_table_window(abs_path, sep, offset=0, rows=PREVIEW_TABLE_ROWS):
+    """Read ``rows`` data rows starting at ``offset`` without loading the file.
 
-def _do_tsv_preview(root, file_path, url, **kwargs):
-    abs_path = os.path.join(root, file_path)
+    Column names and dtypes come from a sample at the head of the file, the
+    window itself is read with ``skiprows``/``nrows`` so memory stays bounded
+    by the window size.
+    """
     import pandas as pd
 
-    df = pd.read_table(abs_path)
-    mask = df.applymap(type) != bool
-    d = {True: "True", False: "False"}
-    df = df.where(mask, df.replace(d))
-    df = df.replace(np.nan, None)
+    sample = pd.read_csv(abs_path, sep=sep, nrows=rows)
+    if offset == 0:
+        return sample
+    window_kwargs = dict(
+        sep=sep,
+        header=None,
+        names=list(sample.columns),
+        skiprows=offset + 1,
+        nrows=rows,
+    )
+    try:
+        return pd.read_csv(abs_path, dtype=sample.dtypes.to_dict(), **window_kwargs)
+    except (ValueError, TypeError):
+        # the sample's dtypes do not fit this window, let pandas infer them
+        return pd.read_csv(abs_path, **window_kwargs)
+
+
+def _normalize_table_window(df):
+    """Render bools as text and NaN as empty cells, column by column."""
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == bool:
+            df[col] = series.astype(str)
+        elif series.dtype == object:
+            mask = series.map(type).eq(bool)
+            if mask.any():
+                df[col] = series.where(~mask, series.astype(str))
+    nan_columns = df.columns[df.isna().any()]
+    if len(nan_columns):
+        df[nan_columns] = df[nan_columns].astype(object).where(
+            df[nan_columns].notna(), None
+        )
+    return df
+
+
+def _do_table_preview(root, file_path, url, sep, rows=PREVIEW_TABLE_ROWS, **kwargs):
+    abs_path = os.path.join(root, file_path)
+    offset_key = f'{kwargs.get("key", abs_path)}-offset'
+    offset = st.session_state.get(offset_key, 0)
+    df = preview_cache.get_or_prepare(
+        abs_path,
+        "table",
+        lambda: _normalize_table_window(
+            _read_table_window(abs_path, sep, offset, rows)
+        ),
+        sep=sep,
+        offset=offset,
+        rows=rows,
+    )
+    if offset or len(df) == rows:
+        st.number_input(
+            f"First row (showing {rows} rows per page)",
+            min_value=0,
+            step=rows,
+            key=offset_key,
+        )
     st.dataframe(df, **kwargs)
     return True
 
 
+def _do_csv_preview(root, file_path, url, **kwargs):
+    return _do_table_preview(root, file_path, url, sep=",", **kwargs)
+
+
+def _do_tsv_preview(root, file_path, url, **kwargs):
+    return _do_table_preview(root, file_path, url, sep="\t", **kwargs)
+
+
 def _do_json_preview(root, file_path, url, **kwargs):
     abs_path = os.path.join(root, file_path)
-    with open(abs_path) as f:
-        st.json(f.read(), **kwargs)
+    text, complete = _read_text_preview(
+        abs_path, f'{kwargs.get("key", abs_path)}-preview'
+    )
+    if complete:
+        st.json(text, **kwargs)
+    else:
+        # a window of a JSON document does not parse, show it as text
+        st.code(text, language="json")
 
 
 def _do_html_preview(root, file_path, url, **kwargs):
+    from streamlit_embeded import st_embeded
+
     abs_path = os.path.join(root, file_path)
     with open(abs_path) as f:
         html = f.read()
         # TODO fix this hardcode
 
-        artifacts_url = urljoin("https://launching.mlops.dp.tech/artifacts/", file_path[: file_path.rfind("/")+1])
-        print(f"artifacts_url old: {artifacts_url}")
         artifacts_url = url[: url.rfind("/")+1]
-        print(f"artifacts_url: {artifacts_url}")
         artifacts_url = artifacts_url.replace("https://launching.mlops.dp.tech/users/", "https://launching.mlops.dp.tech/artifacts/users/")
         artifacts_url = artifacts_url.replace("https://canary-launching.mlops.dp.tech/users/", "https://canary-launching.mlops.dp.tech/artifacts/users/")
         html = html.replace("launching-artifacts://", artifacts_url)
@@ -161,16 +358,18 @@ def _do_html_preview(root, file_path, url, **kwargs):
 
 def _do_markdown_preview(root, file_path, url, **kwargs):
     abs_path = os.path.join(root, file_path)
-    with open(abs_path) as f:
-        key = f'{kwargs.get("key", abs_path)}-preview'
-        st.markdown(f.read(), unsafe_allow_html=True)
+    key = f'{kwargs.get("key", abs_path)}-preview'
+    text, _ = _read_text_preview(abs_path, key)
+    st.markdown(text, unsafe_allow_html=True)
 
 
 def _do_plain_preview(root, file_path, url, **kwargs):
+    from streamlit_ace import st_ace
+
     abs_path = os.path.join(root, file_path)
-    with open(abs_path) as f:
-        key = f'{kwargs.get("key", abs_path)}-preview'
-        st_ace(value=f.read(), readonly=True, show_gutter=False, key=key)
+    key = f'{kwargs.get("key", abs_path)}-preview'
+    text, _ = _read_text_preview(abs_path, key)
+    st_ace(value=text, readonly=True, show_gutter=False, key=key)
 
 
 # RNA Secondary Structure Formats
@@ -189,7 +388,9 @@ def _do_dbn_preview(root, file_path, url, **kwargs):
     components.iframe(url, height=600)
 
 
-PREVIEW_HANDLERS = {
+# Handlers import their component (molstar, ace, ...) when first used, more
+# come from the ``streamlit_file_browser.previews`` entry points.
+PREVIEW_HANDLERS = PreviewRegistry({
     extention: handler
     for extentions, handler in [
         (
@@ -225,7 +426,40 @@ PREVIEW_HANDLERS = {
         ((".dbn",), _do_dbn_preview),
     ]
     for extention in extentions
-}
+})
+
+
+# how long a preview waits for a conversion before showing it as pending
+CONVERSION_WAIT = 0.5
+
+
+def _wait_for_conversion(future, basename):
+    """The converted path of ``future``, None while it is still running.
+
+    After ``CONVERSION_WAIT`` seconds the conversion is shown as pending by a
+    fragment that polls it and reruns the app once it is done. Streamlit
+    without fragments waits for it instead.
+    """
+    try:
+        return future.result(CONVERSION_WAIT)
+    except FutureTimeoutError:
+        pass
+    if not hasattr(st, "fragment"):
+        with st.spinner(f"Converting {basename}"):
+            return future.result()
+
+    @st.fragment(run_every=CONVERSION_WAIT)
+    def pending():
+        if not future.done():
+            st.info(f"Converting {basename}, the preview shows once it is done")
+        elif future.exception() is not None:
+            st.error(f"failed to convert {basename}")
+            st.exception(future.exception())
+        else:
+            st.rerun()
+
+    pending()
+    return None
 
 
 def show_file_preview(
@@ -240,65 +474,159 @@ def show_file_preview(
     target_path = selected_file["path"]
     abs_path = os.path.join(root, target_path)
     basename = os.path.basename(target_path)
-    preview_raw = not is_binary(abs_path)
+    sniff = sniff_file(abs_path)
+    preview_raw = sniff.is_text
     if preview_raw:
         preview, raw = st.tabs(["Preview", "Text"])
     else:
         preview, raw = st.container(), None
 
     with preview:
-        if basename in ("POSCAR", "CONTCAR", "POSCAR.txt", "CONTCAR.txt"):
-            basename = f"{basename}.cif"
-            target_path = os.path.join(os.path.dirname(target_path), basename)
-            abs_target_path = os.path.join(root, target_path)
-            if not os.path.exists(abs_target_path):
-                from pymatgen.core import Structure
-
-                structure = Structure.from_file(abs_path)
-                structure.to(filename=abs_target_path, **kwargs)
-
-        ext = os.path.splitext(target_path)[1]
-        text_mode = not is_binary(abs_path)
-        handles = copy.copy(PREVIEW_HANDLERS)
-        handles.update(overide_preview_handles or {})
-        if ext in handles:
+        url = urljoin(artifacts_site, target_path) if artifacts_site else None
+        conversions = get_conversion_service()
+        if conversions.find(abs_path) is not None:
+            # converted on the service's threads into its cache, outside of
+            # the tree, and previewed from there
             try:
-                handler = handles[ext]
-                url = urljoin(artifacts_site, target_path) if artifacts_site else None
-                handler(root, target_path, url, **kwargs)
+                converted = conversions.submit(abs_path)
+                if not isinstance(converted, str):
+                    converted = _wait_for_conversion(converted, basename)
             except Exception as e:
-                st.error(f"failed preview {target_path}")
+                st.error(f"failed to convert {target_path}")
                 st.exception(e)
-        elif ft := image_match(abs_path):
-            st.image(abs_path, **kwargs)
-        elif ft := video_match(abs_path):
-            st.video(abs_path, format=ft.mime, **kwargs)
-        elif ft := audio_match(abs_path):
-            st.audio(abs_path, format=ft.mime, **kwargs)
-        elif not text_mode:
+                return
+            if converted is None:
+                return
+            root, target_path = os.path.split(converted)
+            url = None
+
+        ext = os.path.splitext(target_path)[1]
+        overrides = overide_preview_handles or {}
+        if ext in overrides or ext in PREVIEW_HANDLERS:
+            hits, misses = preview_cache.hits, preview_cache.misses
+            with metrics.timer("show_file_preview", handler=ext, bytes=selected_file.get("size", 0)) as m:
+                try:
+                    handler = overrides[ext] if ext in overrides else PREVIEW_HANDLERS[ext]
+                    handler(root, target_path, url, **kwargs)
+                except Exception as e:
+                    m["errors"] = 1
+                    st.error(f"failed preview {target_path}")
+                    st.exception(e)
+                m["cache_hit"] = preview_cache.hits - hits
+                m["cache_miss"] = preview_cache.misses - misses
+        # With a file server the browser streams media itself, with range
+        # requests, instead of the whole file going through the websocket.
+        elif sniff.kind == "image":
+            scaled = _preview_image_path(abs_path, kwargs.get("key", abs_path))
+            st.image(scaled or url or abs_path, **kwargs)
+        elif sniff.kind == "video":
+            st.video(url or abs_path, format=sniff.mime, **kwargs)
+        elif sniff.kind == "audio":
+            st.audio(url or abs_path, format=sniff.mime, **kwargs)
+        elif not sniff.is_text:
             st.info(f"No preview aviable for {ext}")
 
     if raw:
         with raw:
-            with open(abs_path) as f:
-                rs = f.readlines(10000)
-                if len(rs) == 10000:
-                    st.warning("File too large, only show first 10000 lines")
-                key = f"{kwargs.get('key', abs_path)}-raw"
-                st_ace(value="".join(rs), readonly=True, show_gutter=False, key=key)
-
-
-def _get_file_info(root, path):
-    stat = os.stat(path)
-    info = {
-        "path": path[len(root) + 1 :],
-        "size": stat.st_size,
-        "create_time": stat.st_ctime * 1000,
-        "update_time": stat.st_mtime * 1000,
-        "access_time": stat.st_atime * 1000,
-    }
-    info["name"] = os.path.basename(path)
-    return info
+            from streamlit_ace import st_ace
+
+            key = f"{kwargs.get('key', abs_path)}-raw"
+            text, _ = _read_text_preview(abs_path, key)
+            st_ace(value=text, readonly=True, show_gutter=False, key=key)
+
+
+def _walk_tree_listing(
+    root, glob_patterns, file_ignores, limit, use_cache, force_rebuild, use_watcher, workers,
+    builder=None,
+):
+    with metrics.timer("ensure_tree_cache.walk") as m:
+        if use_watcher:
+            # The watcher patches file system events into its index, so the
+            # listing is current without validating a single directory.
+            watcher = watch_tree(root)
+            with watcher.lock:
+                files = walk_tree(
+                    root, glob_patterns, file_ignores, limit,
+                    index=watcher.index, workers=workers, builder=builder,
+                )
+        elif use_cache:
+            # The cache keeps raw per directory listings, globs and ignores
+            # are applied on top, so only directories whose mtime moved
+            # are rescanned. ``search_tree`` shares the snapshot.
+            lock, index = cached_tree_index(root, rebuild=force_rebuild)
+            with lock:
+                files = walk_tree(
+                    root, glob_patterns, file_ignores, limit,
+                    index=index, workers=workers, builder=builder,
+                )
+                m["cache_updated"] = index.dirty
+                index.save()
+        else:
+            files = walk_tree(
+                root, glob_patterns, file_ignores, limit, workers=workers, builder=builder
+            )
+        m["files"] = len(files)
+    return files
+
+
+def ensure_tree_listing(
+    path: str,
+    glob_patterns=("**/*",),
+    file_ignores=None,
+    limit=10000,
+    use_cache: bool = False,
+    force_rebuild: bool = False,
+    use_shared_cache: bool = False,
+    use_watcher: bool = False,
+    workers: int = None,
+    background: bool = False,
+):
+    """Return the visible files of ``path`` as a columnar ``Listing``.
+
+    ``workers`` above one scans directories and stats files on that many
+    threads, which pays off on network file systems. The listing is the
+    same either way.
+
+    With ``background`` the walk runs on a thread shared through the
+    shared cache and the call returns at once. Until the walk is done the
+    listing holds the files found so far and has ``partial`` set, later
+    calls, e.g. from reruns, look at the same walk.
+    """
+    root = os.path.abspath(path)
+    with metrics.timer("ensure_tree_cache") as m:
+        if background and not force_rebuild:
+            key = ListingCache.make_key(root, glob_patterns, file_ignores, limit)
+            builder = ListingBuilder()
+            files, complete = shared_listing_cache.get_or_start(
+                key,
+                partial(
+                    _walk_tree_listing,
+                    root, glob_patterns, file_ignores, limit, use_cache, False, use_watcher, workers,
+                    builder=builder,
+                ),
+                builder.snapshot,
+            )
+            m["partial"] = not complete
+        elif use_shared_cache and not force_rebuild:
+            key = ListingCache.make_key(root, glob_patterns, file_ignores, limit)
+            walked = []
+
+            def compute():
+                walked.append(True)
+                return _walk_tree_listing(
+                    root, glob_patterns, file_ignores, limit, use_cache, False, use_watcher, workers
+                )
+
+            # listings are never changed in place, all callers share one
+            files = shared_listing_cache.get_or_compute(key, compute)
+            m["cache_hit"] = not walked
+            m["cache_miss"] = bool(walked)
+        else:
+            files = _walk_tree_listing(
+                root, glob_patterns, file_ignores, limit, use_cache, force_rebuild, use_watcher, workers
+            )
+        m["files"] = len(files)
+    return files
 
 
 def ensure_tree_cache(
@@ -308,61 +636,299 @@ def ensure_tree_cache(
     limit=10000,
     use_cache: bool = False,
     force_rebuild: bool = False,
+    use_shared_cache: bool = False,
+    use_watcher: bool = False,
+    workers: int = None,
 ):
-    cache_path = os.path.join(path, CACHE_FILE_NAME)
-    if use_cache and not force_rebuild and os.path.exists(cache_path):
-        with open(cache_path, "r") as cache_file:
-            return json.load(cache_file)
+    """Like ``ensure_tree_listing``, as a list of file info dicts."""
+    return ensure_tree_listing(
+        path,
+        glob_patterns,
+        file_ignores,
+        limit,
+        use_cache=use_cache,
+        force_rebuild=force_rebuild,
+        use_shared_cache=use_shared_cache,
+        use_watcher=use_watcher,
+        workers=workers,
+    ).to_dicts()
 
-    root = pathlib.Path(os.path.abspath(path))
 
-    _files = [
-        root / f
-        for f in glob.glob(
-            root_dir=path,
-            patterns=glob_patterns,
-            flags=glob.GLOBSTAR | glob.NODIR,
-            limit=limit,
-        )
+def invalidate_tree_cache(path=None):
+    """Mark listings of ``path`` dirty, e.g. after uploading or deleting files.
+
+    Drops shared listings of every root containing ``path`` and forgets the
+    lazy mode snapshot below it. Without ``path`` all listings are dropped.
+    """
+    shared_listing_cache.invalidate(path)
+    invalidate_search(path)
+    with _lazy_indexes_lock:
+        for root in list(_lazy_indexes):
+            if path is None:
+                del _lazy_indexes[root]
+                continue
+            rel_path = os.path.relpath(os.path.realpath(path), root)
+            if rel_path == ".":
+                del _lazy_indexes[root]
+            elif not rel_path.startswith(".."):
+                _lazy_indexes[root].forget(rel_path)
+
+
+_lazy_indexes = {}
+_lazy_indexes_lock = threading.Lock()
+
+
+def update_tree_cache(path, removed=(), added=(), workers=None):
+    """Patch listings of ``path`` after files below it changed.
+
+    Like ``invalidate_tree_cache``, but shared listings of the root ``path``
+    are brought up to date with ``patch_listing``, which only walks the
+    ``removed`` and ``added`` paths (relative to ``path``).
+    """
+    root = os.path.realpath(path)
+
+    def patch(key, listing):
+        _, glob_patterns, (retain_parent, rules, dir_rules), limit = key
+        file_ignores = {"retain_parent": retain_parent, "rules": rules, "dir_rules": dir_rules}
+        with metrics.timer("listing.patch", files=len(listing)):
+            return patch_listing(
+                listing, root, glob_patterns, file_ignores, limit, removed, added, workers
+            )
+
+    shared_listing_cache.update(root, patch)
+    invalidate_search(root)
+    with _lazy_indexes_lock:
+        index = _lazy_indexes.get(root)
+        if index is not None:
+            for rel_path in {*removed, *added}:
+                index.forget(rel_path)
+
+
+@add_upload_listener
+def _update_after_upload(root, rel_path):
+    update_tree_cache(root, added=[rel_path])
+
+
+def _operation_events(show_delete_file, show_new_folder, show_rename_file, show_rename_folder):
+    """Event types ``handle_operations`` applies, as enabled in the component."""
+    types = []
+    if show_delete_file:
+        types += ["DELETE_FILE", "DELETE_FOLDER"]
+    if show_new_folder:
+        types += ["CREATE_FOLDER"]
+    if show_rename_file:
+        types += ["RENAME_FILE", "MOVE_FILE"]
+    if show_rename_folder:
+        types += ["RENAME_FOLDER", "MOVE_FOLDER"]
+    return types
+
+
+def _handle_operations(root, key, allowed, workers):
+    """Apply the file operations of the last event of the component ``key``.
+
+    The event is read from ``st.session_state`` before rendering, like
+    ``LOAD_FOLDER``, so the listing of this rerun already shows the result.
+    Each event is applied once, reruns see it again in the session state.
+    The component stamps every event with a ``nonce``, so the same change
+    made twice is applied twice.
+    """
+    event = st.session_state.get(key) if key else None
+    events = [
+        e
+        for e in (event if isinstance(event, list) else [event])
+        if isinstance(e, dict) and e.get("type") in allowed
     ]
-    
-    ignore_collection = {}
-    def _check_ignore(f, ignore):
-        if isinstance(ignore, re.Pattern):
-            if not ignore.match(os.path.basename(f)):
-                return True
-            else:
-                ignore_collection[os.path.dirname(f)] = False
-                return False
-        elif type(ignore) == str:
-            if os.path.basename(f) in ignore:
-                ignore_collection[os.path.dirname(f)] = False
-                return False
-            else:
-                return True
-            
-    retain_parent, current_file_ignores = (file_ignores.get("retain_parent", False), file_ignores.get("rules", [])) if type(file_ignores) == dict else (False, file_ignores or [])
+    state_key = f"{key}-applied"
+    nonce = events[0].get("nonce") if events else None
+    # events of older builds have no nonce, compare them as a whole
+    applied = nonce if nonce is not None else copy.deepcopy(event)
+    if not events or st.session_state.get(state_key) == applied:
+        return None
+    st.session_state[state_key] = applied
 
-    for ignore in current_file_ignores or []:
-        _files = list(filter(lambda f: _check_ignore(f, ignore), _files))
-    
-    
-        
-    files = [_get_file_info(str(root), str(path)) for path in _files]
-    if retain_parent:
-        for f in _files:
-            parent = os.path.dirname(f)
-            if parent in ignore_collection:
-                ignore_collection[parent] = True
-
-        redeem_dir = [path for path, exist in ignore_collection.items() if not exist]
-        for redeem in redeem_dir:
-            files.append(_get_file_info(str(root), f"{redeem.rstrip('/')}/"))
-
-    if use_cache:
-        with open(cache_path, "w+") as cache_file:
-            json.dump(files, cache_file)
-    return files
+    operations = plan_operations(events)
+    bar = st.progress(0.0) if len(operations) > 1 else None
+
+    def progress(done, total):
+        bar.progress(done / total, text=f"Applied {done} of {total} file operations")
+
+    result = apply_operations(root, operations, progress=progress if bar is not None else None)
+    if bar is not None:
+        bar.empty()
+    update_tree_cache(root, result.removed, result.added, workers)
+    if result.failed:
+        details = "; ".join(f"{op.path}: {message}" for op, message in result.failed[:5])
+        st.warning(f"{len(result.failed)} of {len(operations)} file operations failed. {details}")
+    return result
+
+
+def _lazy_tree_listing(root, key, glob_patterns, file_ignores, limit, use_watcher, workers=None):
+    """Children of the root and of every folder this session has opened.
+
+    The component asks for a folder with a ``LOAD_FOLDER`` event. The value
+    is read from ``st.session_state`` before rendering, so the children ship
+    in the same rerun. Listings come from an in memory ``TreeIndex`` per
+    root, which only rescans directories whose mtime moved.
+    """
+    loaded = st.session_state.setdefault(f"{key}-loaded-folders", [""])
+    event = st.session_state.get(key) if key else None
+    if isinstance(event, dict) and event.get("type") == "LOAD_FOLDER":
+        folder = event["target"]["path"].strip("/")
+        if folder not in loaded:
+            loaded.append(folder)
+
+    if use_watcher:
+        watcher = watch_tree(root)
+        lock, index = watcher.lock, watcher.index
+    else:
+        lock = _lazy_indexes_lock
+        with lock:
+            # by the real path, as ``update_tree_cache`` is called for uploads
+            index = _lazy_indexes.setdefault(os.path.realpath(root), TreeIndex(root))
+    with lock:
+        files = []
+        for folder in loaded:
+            files.extend(
+                list_dir(
+                    root,
+                    folder,
+                    glob_patterns,
+                    file_ignores,
+                    limit - len(files),
+                    index=index,
+                    workers=workers,
+                )
+            )
+            if len(files) >= limit:
+                break
+    return files, [f"{folder}/" for folder in loaded if folder]
+
+
+def _search_query(key):
+    """The text of the last ``SEARCH`` event of the component ``key``."""
+    state_key = f"{key}-search"
+    event = st.session_state.get(key) if key else None
+    if isinstance(event, dict) and event.get("type") == "SEARCH":
+        st.session_state[state_key] = event["target"].get("query", "").strip()
+    return st.session_state.get(state_key, "")
+
+
+def _query_listing(listing, key, sort, search, extentions, page_size):
+    """Filter, sort and page ``listing`` on the server.
+
+    With ``page_size`` only the pages the user scrolled to are returned,
+    the component asks for the next one with a ``LOAD_MORE`` event that is
+    read from ``st.session_state`` before rendering, like ``LOAD_FOLDER``.
+    Returns ``(files, page)`` where ``page`` describes the paging for the
+    component. A callable ``sort`` gets all rows before anything is cut,
+    so the pages hold the top of its order.
+    """
+    query = repr((sort, search, extentions))
+    if callable(sort):
+        listing = Listing.from_dicts(sort(listing.to_dicts()))
+        sort = None
+    if not page_size:
+        return listing.query(sort, search, extentions)[0], None
+
+    state = st.session_state.setdefault(f"{key}-pages", {"query": query, "rows": page_size})
+    if state["query"] != query:
+        state.update(query=query, rows=page_size)
+    event = st.session_state.get(key) if key else None
+    if (
+        isinstance(event, dict)
+        and event.get("type") == "LOAD_MORE"
+        and event["target"].get("query") == query
+    ):
+        state["rows"] = max(state["rows"], event["target"]["offset"] + page_size)
+
+    files, total = listing.query(sort, search, extentions, 0, state["rows"])
+    return files, {"loaded": len(files), "total": total, "query": query}
+
+
+def _sort_files(files, sort):
+    """Sort file info dicts by a ``Listing.query`` sort key, ties keep their order."""
+    key = sort.lstrip("-")
+    if key not in SORT_KEYS:
+        raise ValueError(f"unknown sort key {key!r}, expected one of {SORT_KEYS}")
+    if key == "path":
+        value = lambda file: file["path"]
+    elif key == "name":
+        value = lambda file: file["path"].rpartition("/")[2]
+    else:
+        value = lambda file: file.get(key, 0)
+    return sorted(files, key=value, reverse=sort.startswith("-"))
+
+
+# thumbnails rendered ahead of the component asking for them
+THUMBNAIL_PREFETCH = 64
+
+
+def _thumbnail_params(root, files):
+    """Component params of the thumbnail grid.
+
+    The first ``THUMBNAIL_PREFETCH`` thumbnails of ``files`` are queued on
+    the process pool, so most are ready when the component asks for them.
+    """
+    extensions = thumbnail_extensions()
+    service = get_thumbnail_service()
+    paths = files.paths() if isinstance(files, Listing) else (file["path"] for file in files)
+    queued = 0
+    for path in paths:
+        if queued >= THUMBNAIL_PREFETCH:
+            break
+        if path.lower().endswith(extensions):
+            service.submit(os.path.join(root, path))
+            queued += 1
+    return {
+        "thumbnail_site": get_file_server().thumbnail_url(root),
+        "thumbnail_extensions": list(extensions),
+    }
+
+
+def _listing_params(listing, key):
+    """Component params sending ``listing`` as a delta of the last rerun.
+
+    The component keeps the listing it got last. With a ``key`` only its
+    ``listing_version`` is sent when nothing changed, and the removed paths
+    plus the new or changed rows when few did. A component that does not
+    hold the base version, e.g. after a remount, answers with a ``RESYNC``
+    event for it and gets the full listing on that rerun. Returns ``(params,
+    commit)``, ``commit()`` records the listing as sent once the component
+    rendered.
+    """
+    params = {"listing_version": secrets.token_hex(8)}
+    sent = st.session_state.get(f"{key}-listing") if key else None
+    event = st.session_state.get(key) if key else None
+    if (
+        sent
+        and isinstance(event, dict)
+        and event.get("type") == "RESYNC"
+        and event["target"].get("version") == sent["version"]
+    ):
+        sent = None
+
+    changes = sent and listing.diff(sent["listing"])
+    if changes and not changes[0] and not len(changes[1]):
+        params["listing_version"] = sent["version"]
+    elif changes and len(changes[0]) + len(changes[1]) <= len(listing) // 2:
+        removed, added = changes
+        params["listing_delta"] = {
+            "base": sent["version"],
+            "removed": removed,
+            "at": added.tolist(),
+            "rows": listing.take(added).compact().to_payload(),
+        }
+    else:
+        params["listing"] = listing.to_payload()
+
+    def commit():
+        if key:
+            st.session_state[f"{key}-listing"] = {
+                "version": params["listing_version"],
+                "listing": listing,
+            }
+
+    return params, commit
 
 
 def st_file_browser(
@@ -392,9 +958,24 @@ def st_file_browser(
     overide_preview_handles=None,
     static_file_server_path=None,
     sort=None,
+    lazy=False,
+    use_shared_cache=False,
+    use_watcher=False,
+    use_local_file_server=False,
+    show_metrics=False,
+    scan_workers=None,
+    search=None,
+    page_size=None,
+    show_search=False,
+    background=False,
+    handle_operations=False,
+    show_thumbnails=False,
 ):
     extentions = tuple(extentions) if extentions else None
     root = pathlib.Path(os.path.abspath(path))
+    if use_local_file_server and not artifacts_site:
+        artifacts_site, local_download_site = serve_files(str(root))
+        artifacts_download_site = artifacts_download_site or local_download_site
     if use_static_file_server and static_file_server_path:
         event = render_static_file_server(
             key,
@@ -408,44 +989,129 @@ def st_file_browser(
             show_upload_file,
         )
     else:
-        files = ensure_tree_cache(
-            path,
-            glob_patterns,
-            file_ignores,
-            limit,
-            use_cache=use_cache,
-        )
+        other_params = {}
+        if use_local_file_server and show_download_file:
+            # folders and multiple files download as one streamed archive
+            other_params["archive_site"] = get_file_server().archive_url(str(root), file_ignores)
+        if use_local_file_server and show_upload_file:
+            # chunked and resumable, straight into the tree
+            other_params["upload_site"] = get_file_server().upload_url(str(root))
+        if handle_operations:
+            _handle_operations(
+                str(root),
+                key,
+                _operation_events(
+                    show_delete_file, show_new_folder, show_rename_file, show_rename_folder
+                ),
+                scan_workers,
+            )
+        query = _search_query(key) if show_search else ""
+        if query:
+            # matches anywhere in the tree, not only within ``limit``
+            files = search_tree(
+                str(root),
+                query,
+                glob_patterns,
+                file_ignores,
+                limit,
+                use_cache=use_cache,
+                use_watcher=use_watcher,
+            )
+        elif lazy:
+            files, loaded_folders = _lazy_tree_listing(
+                str(root), key, glob_patterns, file_ignores, limit, use_watcher, scan_workers
+            )
+            other_params["lazy"] = True
+            other_params["loaded_folders"] = loaded_folders
+        else:
+            try:
+                files = ensure_tree_listing(
+                    path,
+                    glob_patterns,
+                    file_ignores,
+                    limit,
+                    use_cache=use_cache,
+                    use_shared_cache=use_shared_cache,
+                    use_watcher=use_watcher,
+                    workers=scan_workers,
+                    background=background,
+                )
+            except Exception as e:
+                if not background:
+                    raise
+                # the background walk failed, shown once and not polled
+                # for, the next rerun walks again
+                st.error(f"failed to list {path}: {e}")
+                files = Listing.empty()
+            if files.partial:
+                # the component reruns until the background walk is done
+                other_params["partial"] = {"files": len(files)}
         
-        files = (
-            [file for file in files if str(file["path"]).endswith(extentions)]
-            if extentions
-            else files
-        )
+        if isinstance(files, Listing):
+            files, page = _query_listing(files, key, sort, search, extentions, page_size)
+            if page:
+                other_params["page"] = page
+        elif extentions:
+            files = [
+                file
+                for file in files
+                if str(file["path"]).endswith(extentions)
+                or (lazy and file["path"].endswith("/"))
+            ]
         if show_preview and show_preview_top:
             preview = st.container()
         if not artifacts_download_site and artifacts_site:
             artifacts_download_site = artifacts_site
             
-        other_params = {}
-        if sort and callable(sort):
+        if callable(sort) and isinstance(files, list):
             files = sort(files)
+        elif sort and isinstance(files, list):
+            files = _sort_files(files, sort)
+        if sort:
+            # sorted here, the component would sort by name again
             other_params["sort"] = None
+
+        if show_thumbnails and thumbnail_extensions():
+            other_params.update(_thumbnail_params(str(root), files))
+
+        commit = None
+        if isinstance(files, Listing):
+            # sent column by column, the component builds the rows
+            listing_params, commit = _listing_params(files, key)
+            other_params.update(listing_params)
         
-        event = _component_func(
-            files=files,
-            show_choose_file=show_choose_file,
-            show_choose_folder=show_choose_folder,
-            show_download_file=show_download_file,
-            show_delete_file=show_delete_file,
-            show_new_folder=show_new_folder,
-            show_rename_file=show_rename_file,
-            show_rename_folder=show_rename_folder,
-            ignore_file_select_event=ignore_file_select_event,
-            artifacts_download_site=artifacts_download_site,
-            artifacts_site=artifacts_site,
-            key=key,
-            **other_params,
-        )
+        if show_search:
+            other_params["show_search"] = True
+            other_params["search_query"] = query
+        with metrics.timer("st_file_browser.component", files=len(files)) as m:
+            if commit is not None:
+                m["payload"] = next(
+                    p for p in ("listing", "listing_delta", "listing_version") if p in other_params
+                )
+            event = _component_func(
+                files=files if isinstance(files, list) else [],
+                show_choose_file=show_choose_file,
+                show_choose_folder=show_choose_folder,
+                show_download_file=show_download_file,
+                show_delete_file=show_delete_file,
+                show_new_folder=show_new_folder,
+                show_rename_file=show_rename_file,
+                show_rename_folder=show_rename_folder,
+                ignore_file_select_event=ignore_file_select_event,
+                artifacts_download_site=artifacts_download_site,
+                artifacts_site=artifacts_site,
+                key=key,
+                **other_params,
+            )
+            if commit is not None:
+                commit()
+
+    if key and isinstance(event, dict) and event.get("type") == "REFRESH":
+        # polls for a partial listing replace the component value, keep
+        # previewing what was selected before
+        event = st.session_state.get(f"{key}-last-event")
+    elif key:
+        st.session_state[f"{key}-last-event"] = event
 
     if event and type(event) == dict and "type" in event:
         if event["type"] == "SELECT_FILE" and (
@@ -482,9 +1148,23 @@ def st_file_browser(
                         key=f"{key}-preview",
                     )
 
+    if show_metrics:
+        show_metrics_panel()
     return event
 
 
+def show_metrics_panel(registry=None):
+    """Render the per stage timings and counters collected so far."""
+    import pandas as pd
+
+    snapshot = (registry or metrics).snapshot()
+    with st.expander("File browser metrics"):
+        if not snapshot:
+            st.info("No measurements yet")
+            return
+        st.dataframe(pd.DataFrame.from_dict(snapshot, orient="index").fillna(0))
+
+
 if _DEVELOP_MODE or os.getenv("SHOW_FILE_BROWSER_DEMO"):
     current_path = os.path.dirname(os.path.abspath(__file__))
     from streamlit_antd.tabs import st_antd_tabs
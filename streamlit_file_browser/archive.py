@@ -0,0 +1,101 @@
+import os
+import shutil
+import tarfile
+import zipfile
+import posixpath
+
+from .tree import is_ignored, is_internal_file, split_file_ignores
+
+_COPY_CHUNK = 256 * 1024
+
+# Formats that are compressed already, deflating them costs CPU for nothing.
+STORED_EXTENSIONS = frozenset(
+    (
+        ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".heic",
+        ".mp4", ".m4v", ".mkv", ".mov", ".webm", ".avi",
+        ".mp3", ".m4a", ".ogg", ".opus", ".flac",
+        ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".lz4",
+        ".xtc", ".npz", ".pdf", ".parquet",
+    )
+)
+ARCHIVE_FORMATS = ("zip", "tar")
+
+
+def archive_entries(root, rel_paths, file_ignores=None):
+    """Yield ``(abs_path, arcname)`` of the files of ``rel_paths`` below ``root``.
+
+    Folders are walked, symlinks are not followed out of ``root``. Files
+    ignored by ``file_ignores``, as in listings, and the caches and partial
+    uploads of this package are left out. Archive names are relative to the
+    deepest folder holding all ``rel_paths``, so downloading ``results/``
+    gives ``results/...``.
+    """
+    _, rules, dir_rules = split_file_ignores(file_ignores)
+    root = os.path.realpath(root)
+    rel_paths = [p.strip("/") for p in rel_paths]
+    parents = [posixpath.dirname(p) for p in rel_paths]
+    base = posixpath.commonpath(parents) if parents and all(parents) else ""
+    for rel_path in rel_paths:
+        abs_path = os.path.realpath(os.path.join(root, rel_path))
+        if abs_path != root and not abs_path.startswith(root + os.sep):
+            continue
+        arc_path = posixpath.relpath(rel_path, base) if base else rel_path
+        if os.path.isfile(abs_path):
+            yield abs_path, arc_path
+            continue
+        for dirpath, dirnames, filenames in os.walk(abs_path):
+            if dir_rules:
+                dirnames[:] = [d for d in dirnames if not is_ignored(d, dir_rules, is_dir=True)]
+            dirnames.sort()
+            rel_dir = os.path.relpath(dirpath, abs_path).replace(os.sep, "/")
+            prefix = arc_path if rel_dir == "." else posixpath.join(arc_path, rel_dir)
+            for name in sorted(filenames):
+                if is_internal_file(name) or (rules and is_ignored(name, rules)):
+                    continue
+                path = os.path.join(dirpath, name)
+                real = os.path.realpath(path)
+                if real.startswith(root + os.sep) and os.path.isfile(real):
+                    yield path, posixpath.join(prefix, name)
+
+
+def write_zip(fileobj, entries):
+    """Write ``entries`` as a ZIP archive to ``fileobj``, which may be unseekable.
+
+    Files are copied in chunks, so nothing is staged in memory or on disk.
+    ``STORED_EXTENSIONS`` are stored, everything else is deflated.
+    """
+    archive = zipfile.ZipFile(
+        fileobj, "w", zipfile.ZIP_DEFLATED, allowZip64=True, strict_timestamps=False
+    )
+    with archive:
+        for abs_path, arcname in entries:
+            try:
+                info = zipfile.ZipInfo.from_file(abs_path, arcname, strict_timestamps=False)
+                src = open(abs_path, "rb")
+            except OSError:
+                continue
+            if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with src, archive.open(info, "w") as dst:
+                shutil.copyfileobj(src, dst, _COPY_CHUNK)
+
+
+def write_tar(fileobj, entries):
+    """Write ``entries`` as an uncompressed tar stream to ``fileobj``."""
+    with tarfile.open(fileobj=fileobj, mode="w|", bufsize=_COPY_CHUNK) as archive:
+        for abs_path, arcname in entries:
+            try:
+                with open(abs_path, "rb") as src:
+                    info = archive.gettarinfo(arcname=arcname, fileobj=src)
+                    archive.addfile(info, src)
+            except OSError:
+                continue
+
+
+def archive_name(rel_paths, fmt="zip"):
+    """File name of the archive of ``rel_paths``."""
+    names = [posixpath.basename(p.strip("/")) for p in rel_paths]
+    name = names[0] if len(names) == 1 and names[0] else "download"
+    return f"{name}.{fmt}"
@@ -0,0 +1,242 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+from .tree import split_file_ignores
+
+
+class _Flight:
+    def __init__(self, progress=None):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.progress = progress
+
+
+class ListingCache:
+    """Process wide cache of tree listings, shared by every session.
+
+    Entries are evicted least recently used once there are more than
+    ``maxsize`` of them and expire ``ttl`` seconds after they were built.
+    Concurrent misses on one key run a single walk, the other callers wait
+    for its result, or with ``get_or_start`` look at its progress.
+    """
+
+    def __init__(self, maxsize=32, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._failed = {}
+        self._generations = {}
+
+    @staticmethod
+    def make_key(root, glob_patterns, file_ignores, limit):
+        # resolved, the file server reports uploads below the real path
+        return (
+            os.path.realpath(root),
+            tuple(glob_patterns),
+            split_file_ignores(file_ignores),
+            limit,
+        )
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generations.get(key[0], 0)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        return self._run(key, flight, generation, compute)
+
+    def get_or_start(self, key, compute, progress):
+        """Like ``get_or_compute`` without waiting, return ``(value, complete)``.
+
+        A miss runs ``compute`` on a background thread. Until it is done,
+        this and every later call for ``key`` return ``(progress(), False)``
+        of that one run, so reruns do not restart it. An expired entry is
+        still returned as complete while its refresh runs. The error of a
+        failed run is raised once, by the next call, the one after starts
+        over.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry[0] > time.monotonic():
+                    return entry[1], True
+            failed = self._failed.pop(key, None)
+            if failed is not None:
+                raise failed.error
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = self._inflight[key] = _Flight(progress)
+                generation = self._generations.get(key[0], 0)
+                threading.Thread(
+                    target=self._run_quietly,
+                    args=(key, flight, generation, compute),
+                    name="st-file-browser-walk",
+                    daemon=True,
+                ).start()
+        if entry is not None:
+            return entry[1], True
+        if flight.done.is_set() and flight.error is None:
+            return flight.value, True
+        return flight.progress(), False
+
+    def _run(self, key, flight, generation, compute, keep_error=False):
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if keep_error and flight.error is not None:
+                    self._failed[key] = flight
+                # A walk that raced with ``invalidate`` may have seen the old
+                # tree, hand it to the waiters but do not keep it.
+                if flight.error is None and self._generations.get(key[0], 0) == generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def _run_quietly(self, *args):
+        # nobody waits for the error, the next ``get_or_start`` raises it
+        try:
+            self._run(*args, keep_error=True)
+        except Exception:
+            pass
+
+    def invalidate(self, path=None):
+        """Drop listings of any root that contains, or lies under, ``path``.
+
+        Without ``path`` everything is dropped.
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                for root in list(self._generations) + [k[0] for k in self._inflight]:
+                    self._generations[root] = self._generations.get(root, 0) + 1
+                return
+            path = os.path.realpath(path)
+            roots = {k[0] for k in self._entries} | {k[0] for k in self._inflight}
+            for root in roots:
+                if _overlaps(root, path):
+                    self._generations[root] = self._generations.get(root, 0) + 1
+            for key in [k for k in self._entries if _overlaps(k[0], path)]:
+                del self._entries[key]
+
+    def update(self, path, patch):
+        """Like ``invalidate``, but listings of the root ``path`` itself are
+        replaced by ``patch(key, listing)`` instead, unless that is ``None``.
+
+        Patches run outside of the lock, a listing built meanwhile wins.
+        """
+        path = os.path.realpath(path)
+        with self._lock:
+            stale = [(k, e) for k, e in self._entries.items() if k[0] == path]
+        self.invalidate(path)
+        for key, (expires, listing) in stale:
+            patched = patch(key, listing)
+            if patched is None:
+                continue
+            with self._lock:
+                if key not in self._entries and key not in self._inflight:
+                    self._entries[key] = (expires, patched)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+
+
+def _overlaps(root, path):
+    return (
+        root == path
+        or path.startswith(root.rstrip(os.sep) + os.sep)
+        or root.startswith(path.rstrip(os.sep) + os.sep)
+    )
+
+
+shared_listing_cache = ListingCache()
+
+
+def _payload_size(value):
+    if hasattr(value, "memory_usage"):
+        # pandas objects, deep counts the python strings in object columns
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_payload_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class PreviewCache:
+    """LRU of prepared preview payloads, bounded by ``max_bytes``.
+
+    Payloads are keyed by the file's path, size and mtime plus the handler
+    name and its parameters, so an unchanged selection is served from memory
+    on every rerun and any change to the file makes a new key. Payloads
+    larger than the whole budget are not kept.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get_or_prepare(self, abs_path, handler, prepare, **params):
+        stat = os.stat(abs_path)
+        key = (
+            os.path.abspath(abs_path),
+            stat.st_size,
+            stat.st_mtime_ns,
+            handler,
+            tuple(sorted((k, repr(v)) for k, v in params.items())),
+        )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = prepare()
+        size = _payload_size(value)
+        with self._lock:
+            if size <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (size, value)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (evicted, _) = self._entries.popitem(last=False)
+                    self._bytes -= evicted
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+preview_cache = PreviewCache()
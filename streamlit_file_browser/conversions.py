@@ -0,0 +1,170 @@
+import os
+import hashlib
+import tempfile
+import threading
+from fnmatch import fnmatchcase
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import metrics
+from .previews import _resolve
+
+Converter = namedtuple("Converter", "patterns suffix convert")
+Converter.__doc__ = """Turns files whose name matches one of ``patterns`` into ``suffix`` files.
+
+``convert(src_path, dst_path)`` writes the converted file, it may be a
+``"module:function"`` reference imported on first use.
+"""
+
+
+def conversion_cache_dir():
+    """Directory of converted files.
+
+    ``STREAMLIT_FILE_BROWSER_CONVERSION_CACHE`` if set, else a folder in the
+    system temp directory.
+    """
+    return os.getenv("STREAMLIT_FILE_BROWSER_CONVERSION_CACHE") or os.path.join(
+        tempfile.gettempdir(), "st-file-browser-conversions"
+    )
+
+
+def poscar_to_cif(src_path, dst_path):
+    """Convert a VASP ``POSCAR``/``CONTCAR`` structure to CIF."""
+    from pymatgen.core import Structure
+
+    Structure.from_file(src_path).to(filename=dst_path)
+
+
+def xdatcar_to_xyz(src_path, dst_path):
+    """Convert a VASP ``XDATCAR`` trajectory to a multi frame XYZ file."""
+    from pymatgen.io.vasp.outputs import Xdatcar
+
+    with open(dst_path, "w") as f:
+        for i, structure in enumerate(Xdatcar(src_path).structures):
+            f.write(f"{len(structure)}\nframe {i}\n")
+            for site in structure:
+                x, y, z = site.coords
+                f.write(f"{site.specie.symbol} {x:.6f} {y:.6f} {z:.6f}\n")
+
+
+class ConversionService:
+    """Convert files for previews on a thread pool, cached outside the tree.
+
+    Converted files are written to ``cache_dir``, named by a hash of the
+    source path, size and mtime, so the browsed tree and its listing caches
+    are left alone and a changed source is converted again. Concurrent
+    requests for one file share a single conversion.
+    """
+
+    def __init__(self, converters=(), cache_dir=None, workers=2):
+        self.converters = list(converters)
+        self.cache_dir = cache_dir or conversion_cache_dir()
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._inflight = {}
+
+    def register(self, patterns, suffix, convert):
+        """Convert files matching ``patterns`` (globs of the file name) to ``suffix``.
+
+        Later registrations take precedence.
+        """
+        patterns = (patterns,) if isinstance(patterns, str) else tuple(patterns)
+        self.converters.insert(0, Converter(patterns, suffix, convert))
+        return convert
+
+    def find(self, file_path):
+        """The ``Converter`` of ``file_path``, None if it is previewed as it is."""
+        name = os.path.basename(file_path)
+        for converter in self.converters:
+            if any(fnmatchcase(name, pattern) for pattern in converter.patterns):
+                return converter
+        return None
+
+    def path_for(self, abs_path, converter):
+        stat = os.stat(abs_path)
+        key = hashlib.sha1(
+            f"{os.path.abspath(abs_path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8")
+        ).hexdigest()
+        # named like the source, previewers tell formats by their extension
+        return os.path.join(self.cache_dir, key, os.path.basename(abs_path) + converter.suffix)
+
+    def submit(self, abs_path):
+        """Return the converted path if it is cached, else a future of it.
+
+        None for files without a converter.
+        """
+        converter = self.find(abs_path)
+        if converter is None:
+            return None
+        dst = self.path_for(abs_path, converter)
+        if os.path.exists(dst):
+            return dst
+        with self._lock:
+            future = self._inflight.get(dst)
+            if future is not None:
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="st-file-browser-convert"
+                )
+            future = self._inflight[dst] = self._executor.submit(
+                self._convert, converter, abs_path, dst
+            )
+        return future
+
+    def get(self, abs_path, timeout=None):
+        """Return the converted path of ``abs_path``, converting it if needed.
+
+        Waits at most ``timeout`` seconds. Errors of the conversion are
+        raised, ``concurrent.futures.TimeoutError`` when it takes longer.
+        """
+        result = self.submit(abs_path)
+        if result is None or isinstance(result, str):
+            return result
+        return result.result(timeout)
+
+    def _convert(self, converter, abs_path, dst):
+        try:
+            with metrics.timer("preview.convert", suffix=converter.suffix) as m:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                base, ext = os.path.splitext(dst)
+                # the converter may pick the format by the extension, keep it
+                tmp = f"{base}.{threading.get_ident()}.tmp{ext}"
+                try:
+                    _resolve(converter.convert)(abs_path, tmp)
+                    os.replace(tmp, dst)
+                except BaseException:
+                    m["errors"] = 1
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+                m["bytes"] = os.path.getsize(dst)
+            return dst
+        finally:
+            with self._lock:
+                self._inflight.pop(dst, None)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_conversion_service():
+    """Return the process wide ``ConversionService`` with the VASP converters."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ConversionService(
+                [
+                    Converter(("POSCAR", "CONTCAR", "POSCAR.txt", "CONTCAR.txt"), ".cif", poscar_to_cif),
+                    Converter(("XDATCAR", "XDATCAR.txt"), ".xyz", xdatcar_to_xyz),
+                ]
+            )
+        return _service
@@ -28,6 +28,60 @@ interface File {
   access_time?: number
 }
 
+// A listing sent column by column, entries share their directory prefix.
+interface Listing {
+  dirs: string[]
+  dir_ids: number[]
+  names: string[]
+  size: number[]
+  create_time: number[]
+  update_time: number[]
+  access_time: number[]
+}
+
+const expandListing = (listing: Listing): File[] =>
+  listing.names.map((name, i) => {
+    const path = listing.dirs[listing.dir_ids[i]] + name
+    return {
+      path,
+      name: name || path.slice(0, -1).split("/").pop(),
+      size: listing.size[i],
+      create_time: listing.create_time[i],
+      update_time: listing.update_time[i],
+      access_time: listing.access_time[i],
+    }
+  })
+
+// Changes to the listing of version ``base``: rows at the ``removed`` paths
+// are dropped, then ``rows`` are inserted at the indices ``at``.
+interface ListingDelta {
+  base: string
+  removed: string[]
+  at: number[]
+  rows: Listing
+}
+
+const applyDelta = (files: File[], delta: ListingDelta): File[] => {
+  const removed = new Set(delta.removed)
+  const kept = files.filter((file) => !removed.has(file.path))
+  const rows = expandListing(delta.rows)
+  const merged: File[] = []
+  let next = 0
+  for (let i = 0; i < kept.length + rows.length; i++) {
+    merged.push(
+      next < rows.length && delta.at[next] === i ? rows[next++] : kept[i - next]
+    )
+  }
+  return merged
+}
+
+// Paging of a server side query, more rows are asked for with LOAD_MORE.
+interface Page {
+  loaded: number
+  total: number
+  query: string
+}
+
 interface Folder {
   path: string
   name?: string
@@ -47,22 +101,40 @@ enum StreamlitEventType {
   MOVE_FOLDER = "MOVE_FOLDER",
   CHOOSE_FILE = "CHOOSE_FILE",
   CHOOSE_FOLDER = "CHOOSE_FOLDER",
+  LOAD_FOLDER = "LOAD_FOLDER",
+  LOAD_MORE = "LOAD_MORE",
+  SEARCH = "SEARCH",
+  REFRESH = "REFRESH",
+  RESYNC = "RESYNC",
 }
 
 interface StreamlitEvent {
   type: StreamlitEventType
-  target: File | Folder | (File | Folder)[]
+  nonce?: string
+  target:
+    | File
+    | Folder
+    | (File | Folder)[]
+    | { offset: number; query: string }
+    | { query: string }
+    | { refresh: number }
+    | { version: string }
 }
 
 interface State {
   numClicks: number
   isFocused: boolean
+  uploadFolder?: string
+  uploads?: { [path: string]: number }
+  grid?: boolean
 }
 
 interface IArgs {
   files: File[]
   path: string
   artifacts_download_site: string
+  archive_site?: string
+  upload_site?: string
   show_download_file: boolean
   show_delete_file: boolean
   show_choose_folder: boolean
@@ -74,10 +146,92 @@ interface IArgs {
   ignore_file_select_event: boolean
   ignore_folder_select_event: boolean
   static_file_server_path: string
+  lazy?: boolean
+  loaded_folders?: string[]
+  listing?: Listing
+  listing_version?: string
+  listing_delta?: ListingDelta
+  page?: Page
+  show_search?: boolean
+  search_query?: string
+  partial?: { files: number }
+  thumbnail_site?: string
+  thumbnail_extensions?: string[]
 }
 
-const noticeStreamlit = (event: StreamlitEvent | StreamlitEvent[]) =>
-  Streamlit.setComponentValue(event)
+// Every event is unique, the server tells a repeated one from a rerun by it.
+let eventCount = 0
+const eventSession = Math.random().toString(36).slice(2)
+
+const noticeStreamlit = (event: StreamlitEvent | StreamlitEvent[]) => {
+  const nonce = `${eventSession}-${++eventCount}`
+  Streamlit.setComponentValue(
+    Array.isArray(event) ? event.map((e) => ({ ...e, nonce })) : { ...event, nonce }
+  )
+}
+
+// Uploads are sent in chunks of this size, a dropped one is resumed.
+const UPLOAD_CHUNK = 8 * 1024 * 1024
+const UPLOAD_RETRIES = 5
+
+const sha256 = async (data: ArrayBuffer) => {
+  // only in secure contexts, the server takes unchecked chunks too
+  if (!window.crypto?.subtle) {
+    return undefined
+  }
+  const digest = await window.crypto.subtle.digest("SHA-256", data)
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("")
+}
+
+const uploadOffset = async (url: string) =>
+  Number((await fetch(url, { method: "HEAD" })).headers.get("Upload-Offset") || 0)
+
+// Upload ``file`` chunk by chunk to the file server, resuming where the
+// server says after an error.
+const uploadFile = async (
+  file: globalThis.File,
+  url: string,
+  onProgress: (done: number) => void
+) => {
+  let offset = await uploadOffset(url)
+  let failures = 0
+  while (true) {
+    const end = Math.min(offset + UPLOAD_CHUNK, file.size)
+    const chunk = await file.slice(offset, end).arrayBuffer()
+    const headers: Record<string, string> = {
+      "Content-Range": file.size
+        ? `bytes ${offset}-${end - 1}/${file.size}`
+        : "bytes */0",
+    }
+    const digest = await sha256(chunk)
+    digest && (headers["X-Chunk-Sha256"] = digest)
+    let response: Response | undefined
+    try {
+      response = await fetch(url, { method: "PUT", headers, body: chunk })
+    } catch (e) {
+      // dropped connection
+    }
+    if (response?.status === 201) {
+      return
+    }
+    const resume = response?.headers.get("Upload-Offset")
+    if (response && (resume === null || resume === undefined)) {
+      throw new Error(await response.text())
+    }
+    if (!response?.ok) {
+      if (++failures > UPLOAD_RETRIES) {
+        throw new Error(`upload of ${file.name} failed`)
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures))
+    } else {
+      failures = 0
+    }
+    offset = response ? Number(resume) : await uploadOffset(url)
+    onProgress(file.size ? offset / file.size : 1)
+  }
+}
 
 class FileBrowserStaticServer extends StreamlitComponentBase<State> {
   private args: IArgs
@@ -180,11 +334,51 @@ class FileBrowserStaticServer extends StreamlitComponentBase<State> {
 }
 
 class FileBrowserNative extends StreamlitComponentBase<State> {
-  private args: IArgs
+  // Read args on every access, reruns update them without remounting.
+  private get args(): IArgs {
+    return this.props.args
+  }
 
-  constructor(props: ComponentProps) {
-    super(props)
-    this.args = props.args
+  // The listing of the last rerun, later ones may only send changes to it.
+  private held?: { version: string; files: File[] }
+  private resynced?: string
+  // Rows changed by the handlers until the next rerun.
+  private edited?: { args: IArgs; files: File[] }
+
+  private get files(): File[] {
+    const version = this.args.listing_version
+    if (version === undefined) {
+      return this.args.files
+    }
+    if (this.edited?.args === this.args) {
+      return this.edited.files
+    }
+    if (this.held?.version !== version) {
+      const { listing, listing_delta: delta } = this.args
+      if (listing) {
+        this.held = { version, files: expandListing(listing) }
+      } else if (delta && this.held?.version === delta.base) {
+        this.held = { version, files: applyDelta(this.held.files, delta) }
+      } else if (this.resynced !== version) {
+        // remounted or a rerun got lost, ask for the full listing
+        this.resynced = version
+        setTimeout(() =>
+          noticeStreamlit({
+            type: StreamlitEventType.RESYNC,
+            target: { version },
+          })
+        )
+      }
+    }
+    return this.held?.files || []
+  }
+
+  private set files(files: File[]) {
+    if (this.args.listing_version !== undefined) {
+      this.edited = { args: this.args, files }
+    } else {
+      this.args.files = files
+    }
   }
 
   ajustHeight(revoke_step?: number) {
@@ -200,28 +394,117 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
     }
   }
 
+  private moreRef = React.createRef<HTMLDivElement>()
+  private moreObserver?: IntersectionObserver
+  private requestedPage?: string
+
   componentDidMount() {
     this.ajustHeight()
+    this.observeMore()
+    this.pollPartial()
   }
 
   componentDidUpdate() {
     this.ajustHeight()
+    this.observeMore()
+    this.pollPartial()
+  }
+
+  componentWillUnmount() {
+    this.moreObserver?.disconnect()
+    clearTimeout(this.searchTimer)
+    clearTimeout(this.refreshTimer)
   }
 
-  folderOpenHandler = (opts: FileBrowserFolder) => this.ajustHeight()
+  private refreshTimer?: ReturnType<typeof setTimeout>
+  private refreshes = 0
+
+  // The listing is still walked in the background, rerun for the rest.
+  pollPartial = () => {
+    clearTimeout(this.refreshTimer)
+    if (this.args.partial) {
+      this.refreshTimer = setTimeout(
+        () =>
+          noticeStreamlit({
+            type: StreamlitEventType.REFRESH,
+            target: { refresh: ++this.refreshes },
+          }),
+        1000
+      )
+    }
+  }
+
+  private searchTimer?: ReturnType<typeof setTimeout>
+
+  // The tree is searched on the server, wait for a pause in typing.
+  searchChangeHandler = (event: React.ChangeEvent<HTMLInputElement>) => {
+    const query = event.target.value
+    clearTimeout(this.searchTimer)
+    this.searchTimer = setTimeout(() => {
+      query.trim() !== (this.args.search_query || "") &&
+        noticeStreamlit({
+          type: StreamlitEventType.SEARCH,
+          target: { query },
+        })
+    }, 300)
+  }
+
+  // Ask for the next page once the end of the list scrolls into view.
+  observeMore = () => {
+    this.moreObserver?.disconnect()
+    const sentinel = this.moreRef.current
+    if (sentinel && typeof IntersectionObserver !== "undefined") {
+      this.moreObserver = new IntersectionObserver((entries) => {
+        entries.some((entry) => entry.isIntersecting) && this.loadMore()
+      })
+      this.moreObserver.observe(sentinel)
+    }
+  }
+
+  loadMore = () => {
+    const page = this.args.page
+    if (!page || page.loaded >= page.total) {
+      return
+    }
+    // one request per page, reruns answer with a larger page
+    const request = `${page.query}@${page.loaded}`
+    if (this.requestedPage === request) {
+      return
+    }
+    this.requestedPage = request
+    noticeStreamlit({
+      type: StreamlitEventType.LOAD_MORE,
+      target: { offset: page.loaded, query: page.query },
+    })
+  }
+
+  folderOpenHandler = (opts: FileBrowserFolder) => {
+    // In lazy mode the children of a folder are only sent once asked for.
+    if (this.args.lazy && !this.args.loaded_folders?.includes(opts.key)) {
+      noticeStreamlit({
+        type: StreamlitEventType.LOAD_FOLDER,
+        target: { path: opts.key },
+      })
+    }
+    this.ajustHeight()
+  }
   folderCloseHandler = (opts: FileBrowserFolder) => this.ajustHeight()
 
   fileSelectedHandler = (opts: FileBrowserFile) => {
+    this.setState({
+      uploadFolder: opts.key.substring(0, opts.key.lastIndexOf("/") + 1),
+    })
     if (!this.args.ignore_file_select_event) {
-      const file = this.args.files.find((file) => file.path === opts.key)
+      const file = this.files.find((file) => file.path === opts.key)
       file &&
         noticeStreamlit({ type: StreamlitEventType.SELECT_FILE, target: file })
     }
   }
 
   folderSelectedHandler = (opts: FileBrowserFolder) => {
+    this.setState({ uploadFolder: opts.key })
     if (!this.args.ignore_folder_select_event) {
-      const files = this.args.files.filter(
+      const files = this.files.filter(
         (file) => file.path !== opts.key && file.path.startsWith(opts.key)
       )
       files &&
@@ -232,11 +515,37 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
     }
   }
 
+  // Files go into the selected folder, or next to the selected file.
+  uploadHandler = async (event: React.ChangeEvent<HTMLInputElement>) => {
+    const input = event.target
+    const uploaded: File[] = []
+    for (const file of Array.from(input.files || [])) {
+      const path = (this.state?.uploadFolder || "") + file.name
+      try {
+        await uploadFile(
+          file,
+          new URL(path, this.args.upload_site).toString(),
+          (done) =>
+            this.setState({ uploads: { ...this.state?.uploads, [path]: done } })
+        )
+        uploaded.push({ path, name: file.name, size: file.size })
+      } catch (e) {
+        console.error("uploadHandler", path, e)
+      }
+    }
+    input.value = ""
+    this.setState({ uploads: {} })
+    uploaded.length &&
+      noticeStreamlit({ type: StreamlitEventType.CREATE_FILE, target: uploaded })
+  }
+
   downlandHandler = (keys: string[]) => {
-    const files = this.args.files.filter((file) => keys.includes(file.path))
-    files.forEach((file) => {
-      let url = new URL(file.path, this.args.artifacts_download_site).toString()
-      let filename = url.substring(url.lastIndexOf("/") + 1)
+    const files = this.files.filter((file) => keys.includes(file.path))
+    const folders = keys.filter((key) => key.endsWith("/"))
+    const download = (
+      url: string,
+      filename = url.substring(url.lastIndexOf("/") + 1)
+    ) => {
       let a = document.createElement("a")
       a.target = "_blank"
       a.href = url
@@ -244,28 +553,51 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
       document.body.appendChild(a)
       a.click()
       a.parentNode?.removeChild(a)
-    })
-    files.length &&
-      noticeStreamlit({ type: StreamlitEventType.DOWNLOAD, target: files })
+    }
+    if (this.args.archive_site && (folders.length || files.length > 1)) {
+      // one archive streamed by the server instead of a download per file
+      const url = new URL(this.args.archive_site)
+      keys.forEach((key) => url.searchParams.append("path", key))
+      // named by the server
+      download(url.toString(), "")
+    } else {
+      files.forEach((file) =>
+        download(
+          new URL(file.path, this.args.artifacts_download_site).toString()
+        )
+      )
+    }
+    files.length + folders.length &&
+      noticeStreamlit({
+        type: StreamlitEventType.DOWNLOAD,
+        target: [...files, ...folders.map((path) => ({ path }))],
+      })
   }
 
   deleteFileHandler = (fileKey: string | string[]) => {
-    const files = this.args.files.filter((file) =>
+    const files = this.files.filter((file) =>
       typeof fileKey === "string"
         ? fileKey === file.path
         : fileKey.includes(file.path)
     )
     console.log("deleteFileHandler", "key", fileKey, "files ", files)
+    const folders = (typeof fileKey === "string" ? [fileKey] : fileKey)
+      .filter((key) => key.endsWith("/"))
+      .map((key) => ({ path: key }))
 
+    const events: StreamlitEvent[] = []
     files.length &&
-      noticeStreamlit({ type: StreamlitEventType.DELETE_FILE, target: files })
+      events.push({ type: StreamlitEventType.DELETE_FILE, target: files })
+    folders.length &&
+      events.push({ type: StreamlitEventType.DELETE_FOLDER, target: folders })
+    events.length && noticeStreamlit(events.length > 1 ? events : events[0])
 
-    const remainingFiles = this.args.files.filter((file) =>
+    const remainingFiles = this.files.filter((file) =>
       typeof fileKey === "string"
         ? fileKey !== file.path
         : !fileKey.includes(file.path)
     )
-    this.args.files = remainingFiles
+    this.files = remainingFiles
   }
 
   createFolderHandler = (folderKey: string) => {
@@ -280,7 +612,7 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
       .filter((key) => key.endsWith("/"))
       .map((key) => ({ path: key }))
 
-    const files = this.args.files.filter(
+    const files = this.files.filter(
       (file) => keys.includes(file.path) && !file.path.endsWith("/")
     )
 
@@ -313,7 +645,7 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
   }
 
   renameFileHandler = (oldFileKey: string, newFileKey: string) => {
-    const file = this.args.files.find((file) => file.path === oldFileKey)
+    const file = this.files.find((file) => file.path === oldFileKey)
     file &&
       noticeStreamlit({
         type: StreamlitEventType.RENAME_FILE,
@@ -321,9 +653,27 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
       })
   }
 
+  private pendingMoves: StreamlitEvent[] = []
+
+  // The browser reports a drag of several items one by one, send them as
+  // one list of events.
+  moveHandler =
+    (type: StreamlitEventType) => (oldKey: string, newKey: string) => {
+      this.pendingMoves.length ||
+        setTimeout(() => {
+          const moves = this.pendingMoves
+          this.pendingMoves = []
+          noticeStreamlit(moves.length > 1 ? moves : moves[0])
+        })
+      this.pendingMoves.push({
+        type,
+        target: { path: newKey, name: oldKey },
+      })
+    }
+
   renameFolderHandler = (oldFolderKey: string, newFolderKey: string) => {
     console.log("renameFolderHandler", oldFolderKey, newFolderKey)
-    const file = this.args.files.find(
+    const file = this.files.find(
       (file) =>
         file.path.substring(0, file.path.lastIndexOf("/") + 1) === oldFolderKey
     )
@@ -344,17 +694,81 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
       size: file.size || 0,
     }))
 
+  // Files of the selected folder that have a thumbnail, for the grid view.
+  thumbnailFiles = (): File[] => {
+    const folder = this.state?.uploadFolder || ""
+    const extensions = this.args.thumbnail_extensions || []
+    return this.files.filter(
+      (file) =>
+        file.path.startsWith(folder) &&
+        !file.path.slice(folder.length).includes("/") &&
+        extensions.some((ext) => file.path.toLowerCase().endsWith(ext))
+    )
+  }
+
+  thumbnailUrl = (file: File) => {
+    // the mtime keeps cached thumbnails of changed files from being shown
+    const url = new URL(file.path, this.args.thumbnail_site)
+    url.searchParams.set("v", String(file.update_time || 0))
+    return url.toString()
+  }
+
   noop = () => <></>
   public render = () => {
+    const page = this.args.page
     return (
       <div>
+        {this.args.show_search && (
+          <input
+            type="search"
+            className="form-control form-control-sm mb-2"
+            placeholder="Search files in the whole tree, e.g. *_final_model.pdb"
+            defaultValue={this.args.search_query || ""}
+            onChange={this.searchChangeHandler}
+          />
+        )}
+        {this.args.upload_site && (
+          <div className="mb-2 small">
+            Upload to /{this.state?.uploadFolder || ""}{" "}
+            <input type="file" multiple onChange={this.uploadHandler} />
+            {Object.entries(this.state?.uploads || {}).map(([path, done]) => (
+              <div key={path} className="text-muted">
+                {path} {Math.round(done * 100)}%
+              </div>
+            ))}
+          </div>
+        )}
+        {this.args.thumbnail_site && (
+          <label className="mb-2 small d-block">
+            <input
+              type="checkbox"
+              checked={!!this.state?.grid}
+              onChange={(e) => this.setState({ grid: e.target.checked })}
+            />{" "}
+            Thumbnails of /{this.state?.uploadFolder || ""}
+          </label>
+        )}
+        {this.state?.grid && (
+          <div className="st-thumbnails mb-2">
+            {this.thumbnailFiles().map((file) => (
+              <figure
+                key={file.path}
+                title={file.path}
+                onClick={() => this.fileSelectedHandler(this.convertFiles([file])[0])}
+              >
+                <img loading="lazy" src={this.thumbnailUrl(file)} alt={file.name} />
+                <figcaption>{file.name}</figcaption>
+              </figure>
+            ))}
+          </div>
+        )}
         <FileBrowser
           {...this.args}
           showActionBar
           canFilter={true}
           detailRenderer={this.noop}
           icons={Icons.FontAwesome(4)}
-          files={this.convertFiles(this.args.files)}
+          files={this.convertFiles(this.files)}
           onFolderOpen={this.folderOpenHandler}
           onFolderClose={this.folderCloseHandler}
           onSelect={this.fileSelectedHandler}
@@ -364,6 +778,16 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
           onCreateFolder={this.createFolderHandler}
           onRenameFile={this.renameFileHandler}
           onRenameFolder={this.renameFolderHandler}
+          onMoveFile={
+            this.args.show_rename_file
+              ? this.moveHandler(StreamlitEventType.MOVE_FILE)
+              : undefined
+          }
+          onMoveFolder={
+            this.args.show_rename_folder
+              ? this.moveHandler(StreamlitEventType.MOVE_FOLDER)
+              : undefined
+          }
           actionRenderer={(...args: IActionsProps[]) => {
             return Actions({
               ...args[0],
@@ -377,6 +801,10 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
                   this.args.show_download_file &&
                   !!this.args.artifacts_download_site,
                 canDeleteFile: this.args.show_delete_file,
+                canDownloadFolder:
+                  this.args.show_download_file && !!this.args.archive_site,
+                onDownloadFolder: () =>
+                  this.downlandHandler(args[0].selectedItems.map((i) => i.key)),
                 onChooseFolder: () =>
                   this.chooseHandler(args[0].selectedItems.map((i) => i.key)),
                 onChooseFile: () =>
@@ -389,6 +817,18 @@ class FileBrowserNative extends StreamlitComponentBase<State> {
             }) as JSX.Element
           }}
         />
+        {this.args.partial && (
+          <div className="text-center text-muted small">
+            Listing, {this.args.partial.files} files found so far
+          </div>
+        )}
+        {page && page.loaded < page.total && (
+          <div ref={this.moreRef} className="text-center">
+            <button className="btn btn-link btn-sm" onClick={this.loadMore}>
+              Showing {page.loaded} of {page.total}, load more
+            </button>
+          </div>
+        )}
       </div>
     )
   }
@@ -0,0 +1,373 @@
+import os
+import sys
+import heapq
+from collections.abc import Sequence
+
+import numpy as np
+from wcmatch import fnmatch
+
+_TIME_FIELDS = (("create_time", "ctimes"), ("update_time", "mtimes"), ("access_time", "atimes"))
+# sort keys of ``Listing.query`` backed by a numeric column
+_NUMERIC_KEYS = {"size": "sizes", **{field: attr for field, attr in _TIME_FIELDS}}
+SORT_KEYS = ("path", "name", *_NUMERIC_KEYS)
+_GLOB_CHARS = frozenset("*?[")
+
+
+class ListingBuilder:
+    """Collect listing rows directory by directory, see ``Listing``."""
+
+    def __init__(self):
+        self.dirs = []
+        self.dir_ids = []
+        self.names = []
+        self.sizes = []
+        self.ctimes = []
+        self.mtimes = []
+        self.atimes = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_dir(self, rel_dir):
+        """Start the entries of ``rel_dir``, return its prefix id."""
+        self.dirs.append(f"{rel_dir}/" if rel_dir else "")
+        return len(self.dirs) - 1
+
+    def add(self, dir_id, row):
+        name, size, ctime, mtime, atime = row
+        self.dir_ids.append(dir_id)
+        self.names.append(name)
+        self.sizes.append(size)
+        self.ctimes.append(ctime)
+        self.mtimes.append(mtime)
+        self.atimes.append(atime)
+
+    def add_rows(self, dir_id, rows):
+        for row in rows:
+            self.add(dir_id, row)
+
+    def build(self):
+        return Listing(
+            self.dirs,
+            np.array(self.dir_ids, dtype=np.int32),
+            self.names,
+            np.array(self.sizes, dtype=np.int64),
+            np.array(self.ctimes, dtype=np.float64),
+            np.array(self.mtimes, dtype=np.float64),
+            np.array(self.atimes, dtype=np.float64),
+        )
+
+    def snapshot(self):
+        """A ``partial`` listing of the rows added so far.
+
+        Safe to call while another thread is adding: ``atimes`` is appended
+        last, every other column holds at least as many rows.
+        """
+        n = len(self.atimes)
+        listing = Listing(
+            list(self.dirs),
+            np.array(self.dir_ids[:n], dtype=np.int32),
+            self.names[:n],
+            np.array(self.sizes[:n], dtype=np.int64),
+            np.array(self.ctimes[:n], dtype=np.float64),
+            np.array(self.mtimes[:n], dtype=np.float64),
+            np.array(self.atimes[:n], dtype=np.float64),
+        )
+        listing.partial = True
+        return listing
+
+
+class Listing(Sequence):
+    """A file listing stored column by column.
+
+    Entries share their directory prefix through ``dir_ids`` and keep size
+    and times in NumPy arrays, so a listing costs a few dozen bytes per
+    file instead of a dict of six keys. Indexing and iterating yield the
+    usual file info dicts, built on demand. An empty name marks a ``dir/``
+    entry, whose path is its directory prefix. ``partial`` is set on
+    listings of a walk still running in the background.
+    """
+
+    __slots__ = (
+        "dirs", "dir_ids", "names", "sizes", "ctimes", "mtimes", "atimes", "partial", "_paths"
+    )
+
+    def __init__(self, dirs, dir_ids, names, sizes, ctimes, mtimes, atimes):
+        self.dirs = dirs
+        self.dir_ids = dir_ids
+        self.names = names
+        self.sizes = sizes
+        self.ctimes = ctimes
+        self.mtimes = mtimes
+        self.atimes = atimes
+        self.partial = False
+        self._paths = None
+
+    @classmethod
+    def empty(cls):
+        return ListingBuilder().build()
+
+    @classmethod
+    def from_dicts(cls, files):
+        """Build a listing from file info dicts, e.g. after a custom sort."""
+        builder = ListingBuilder()
+        prefixes = {}
+        for file in files:
+            prefix, _, name = file["path"].rpartition("/")
+            dir_id = prefixes.get(prefix)
+            if dir_id is None:
+                dir_id = prefixes[prefix] = builder.add_dir(prefix)
+            builder.add(
+                dir_id,
+                (
+                    name,
+                    file.get("size", 0),
+                    file.get("create_time", 0) / 1000,
+                    file.get("update_time", 0) / 1000,
+                    file.get("access_time", 0) / 1000,
+                ),
+            )
+        return builder.build()
+
+    @classmethod
+    def concat(cls, listings):
+        """One listing of the entries of ``listings``, in that order."""
+        dirs, dir_ids = [], []
+        for listing in listings:
+            dir_ids.append(listing.dir_ids + len(dirs))
+            dirs.extend(listing.dirs)
+        if not dir_ids:
+            return cls.empty()
+        return cls(
+            dirs,
+            np.concatenate(dir_ids).astype(np.int32),
+            [name for listing in listings for name in listing.names],
+            *(
+                np.concatenate([getattr(listing, attr) for listing in listings])
+                for attr in ("sizes", "ctimes", "mtimes", "atimes")
+            ),
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.take(np.arange(len(self))[item])
+        if item < 0:
+            item += len(self)
+        path = self.path(item)
+        return {
+            "path": path,
+            "size": int(self.sizes[item]),
+            "create_time": float(self.ctimes[item]) * 1000,
+            "update_time": float(self.mtimes[item]) * 1000,
+            "access_time": float(self.atimes[item]) * 1000,
+            "name": os.path.basename(path.rstrip("/")),
+        }
+
+    def __iter__(self):
+        return iter(self.to_dicts())
+
+    def __eq__(self, other):
+        if isinstance(other, (Listing, list)):
+            return self.to_dicts() == list(other)
+        return NotImplemented
+
+    def path(self, i):
+        return self.dirs[self.dir_ids[i]] + self.names[i]
+
+    def paths(self):
+        # kept, listings from the shared cache answer many queries
+        if self._paths is None:
+            dirs = self.dirs
+            self._paths = [dirs[d] + name for d, name in zip(self.dir_ids.tolist(), self.names)]
+        return self._paths
+
+    def to_dicts(self):
+        """Return the entries as a list of file info dicts."""
+        paths = self.paths()
+        columns = [self.sizes.tolist()] + [
+            (getattr(self, attr) * 1000).tolist() for _, attr in _TIME_FIELDS
+        ]
+        return [
+            {
+                "path": path,
+                "size": size,
+                "create_time": ctime,
+                "update_time": mtime,
+                "access_time": atime,
+                "name": os.path.basename(path.rstrip("/")),
+            }
+            for path, size, ctime, mtime, atime in zip(paths, *columns)
+        ]
+
+    def take(self, indices):
+        """Return a listing of the entries at ``indices`` (an index array or bool mask)."""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        names = self.names
+        listing = Listing(
+            self.dirs,
+            self.dir_ids[indices],
+            [names[i] for i in indices.tolist()],
+            self.sizes[indices],
+            self.ctimes[indices],
+            self.mtimes[indices],
+            self.atimes[indices],
+        )
+        listing.partial = self.partial
+        return listing
+
+    def compact(self):
+        """Return the listing without the directory prefixes no entry uses."""
+        used, dir_ids = np.unique(self.dir_ids, return_inverse=True)
+        if len(used) == len(self.dirs):
+            return self
+        listing = Listing(
+            [self.dirs[i] for i in used.tolist()],
+            dir_ids.astype(np.int32),
+            self.names,
+            self.sizes,
+            self.ctimes,
+            self.mtimes,
+            self.atimes,
+        )
+        listing.partial = self.partial
+        return listing
+
+    def endswith(self, suffixes):
+        """Bool mask of the entries whose path ends with one of ``suffixes``."""
+        suffixes = tuple(suffixes)
+        return np.fromiter(
+            (path.endswith(suffixes) for path in self.paths()), dtype=bool, count=len(self)
+        )
+
+    def search(self, pattern):
+        """Bool mask of the entries matching ``pattern``, ignoring case.
+
+        A pattern with glob characters is matched against the name, or the
+        path when it holds a ``/``. Otherwise it is a substring of the path.
+        """
+        paths = self.paths()
+        if _GLOB_CHARS.isdisjoint(pattern):
+            needle = pattern.lower()
+            matches = (needle in path.lower() for path in paths)
+        else:
+            matcher = fnmatch.compile(pattern, flags=fnmatch.IGNORECASE)
+            if "/" in pattern:
+                matches = (matcher.match(path) for path in paths)
+            else:
+                matches = (matcher.match(os.path.basename(path.rstrip("/"))) for path in paths)
+        return np.fromiter(matches, dtype=bool, count=len(self))
+
+    def query(self, sort=None, search=None, extensions=None, offset=0, limit=None):
+        """Filter, sort and page the listing, return ``(page, total)``.
+
+        ``sort`` is one of ``SORT_KEYS``, prefixed with ``-`` for descending
+        order. Only the first ``offset + limit`` entries in that order are
+        selected (top-k), the full listing is never sorted. Ties keep the
+        listing order, so pages are stable. ``total`` counts all matches.
+        """
+        mask = None
+        if extensions:
+            mask = self.endswith(extensions)
+        if search:
+            found = self.search(search)
+            mask = found if mask is None else mask & found
+        candidates = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        total = len(candidates)
+        k = total if limit is None else min(total, offset + limit)
+        if sort:
+            candidates = self._top_k(candidates, sort, k)
+        return self.take(candidates[offset:k]), total
+
+    def _top_k(self, candidates, sort, k):
+        descending = sort.startswith("-")
+        key = sort.lstrip("-")
+        if key not in SORT_KEYS:
+            raise ValueError(f"unknown sort key {key!r}, expected one of {SORT_KEYS}")
+        if k == 0:
+            return candidates[:0]
+
+        if key in _NUMERIC_KEYS:
+            values = getattr(self, _NUMERIC_KEYS[key])[candidates]
+            if descending:
+                values = -values
+            if k < len(values):
+                # everything below the k-th value, then its ties in listing order
+                kth = np.partition(values, k - 1)[k - 1]
+                below = np.flatnonzero(values < kth)
+                ties = np.flatnonzero(values == kth)[: k - len(below)]
+                selected = np.concatenate([below, ties])
+            else:
+                selected = np.arange(len(values))
+            order = selected[np.lexsort((selected, values[selected]))]
+            return candidates[order]
+
+        paths = self.paths()
+        if key == "name":
+            strings = [os.path.basename(paths[i].rstrip("/")) for i in candidates.tolist()]
+        else:
+            strings = [paths[i] for i in candidates.tolist()]
+        positions = range(len(strings))
+        if descending:
+            order = heapq.nlargest(k, positions, key=lambda i: (strings[i], -i))
+        else:
+            order = heapq.nsmallest(k, positions, key=lambda i: (strings[i], i))
+        return candidates[np.array(order, dtype=np.intp)]
+
+    def diff(self, previous):
+        """Changes from ``previous`` to this listing, return ``(removed, added)``.
+
+        ``removed`` are the paths of ``previous`` that are gone or changed,
+        ``added`` the indices of the rows of this listing that are new or
+        changed. Returns None when the rows both hold are in another order,
+        e.g. after a change of the sort, then only a full listing will do.
+        """
+        if self._same_rows(previous):
+            return [], np.arange(0)
+        prev_index = dict(zip(previous.paths(), range(len(previous))))
+        old = np.array([prev_index.get(path, -1) for path in self.paths()], dtype=np.intp)
+        same = old >= 0
+        found = np.flatnonzero(same)
+        for attr in ("sizes", "ctimes", "mtimes", "atimes"):
+            same[found] &= getattr(self, attr)[found] == getattr(previous, attr)[old[found]]
+        kept = old[same]
+        if len(kept) > 1 and (np.diff(kept) <= 0).any():
+            return None
+        gone = np.ones(len(previous), dtype=bool)
+        gone[kept] = False
+        prev_paths = previous.paths()
+        return [prev_paths[i] for i in np.flatnonzero(gone).tolist()], np.flatnonzero(~same)
+
+    def _same_rows(self, other):
+        if len(self) != len(other):
+            return False
+        if self.dirs == other.dirs:
+            if not np.array_equal(self.dir_ids, other.dir_ids):
+                return False
+        elif self.paths() != other.paths():
+            return False
+        return self.names == other.names and all(
+            np.array_equal(getattr(self, attr), getattr(other, attr))
+            for attr in ("sizes", "ctimes", "mtimes", "atimes")
+        )
+
+    def to_payload(self):
+        """Column wise JSON payload for the component, times in ms as in the dicts."""
+        return {
+            "dirs": self.dirs,
+            "dir_ids": self.dir_ids.tolist(),
+            "names": self.names,
+            "size": self.sizes.tolist(),
+            **{field: (getattr(self, attr) * 1000).tolist() for field, attr in _TIME_FIELDS},
+        }
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the listing."""
+        arrays = (self.dir_ids, self.sizes, self.ctimes, self.mtimes, self.atimes)
+        strings = (sys.getsizeof(s) for column in (self.dirs, self.names) for s in column)
+        return sum(a.nbytes for a in arrays) + sum(strings) + 8 * (len(self.names) + len(self.dirs))
@@ -0,0 +1,88 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StageStats:
+    __slots__ = ("calls", "total", "max", "last", "counters")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.counters = {}
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.calls if self.calls else 0.0,
+            "max_ms": self.max * 1000,
+            "last_ms": self.last * 1000,
+            **self.counters,
+        }
+
+
+class MetricsRegistry:
+    """Per stage durations and counters of the listing and preview paths.
+
+    Every measurement is aggregated per stage name, numeric fields (file
+    counts, bytes read, cache hits and misses) are summed. Listeners added
+    with ``add_listener`` get each raw measurement as a dict, for forwarding
+    to an external metrics system.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+        return listener
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def record(self, stage, seconds, **fields):
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.calls += 1
+            stats.total += seconds
+            stats.last = seconds
+            stats.max = max(stats.max, seconds)
+            for name, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats.counters[name] = stats.counters.get(name, 0) + value
+                elif isinstance(value, bool):
+                    stats.counters[name] = stats.counters.get(name, 0) + int(value)
+        if self._listeners:
+            event = {"stage": stage, "seconds": seconds, **fields}
+            for listener in list(self._listeners):
+                listener(event)
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """Time the ``with`` block, fields set on the yielded dict are recorded too."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: stats.as_dict() for stage, stats in sorted(self._stages.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+metrics = MetricsRegistry()
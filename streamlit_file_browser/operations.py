@@ -0,0 +1,218 @@
+import os
+import errno
+import shutil
+import posixpath
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .metrics import metrics
+
+OPERATION_EVENTS = (
+    "DELETE_FILE",
+    "DELETE_FOLDER",
+    "MOVE_FILE",
+    "MOVE_FOLDER",
+    "RENAME_FILE",
+    "RENAME_FOLDER",
+    "CREATE_FOLDER",
+)
+# operations handed to a worker at a time
+_BATCH_SIZE = 64
+
+FileOperation = namedtuple("FileOperation", "kind path target")
+FileOperation.__doc__ = """One change to the tree, paths relative to the root.
+
+``kind`` is ``"delete"``, ``"mkdir"`` or ``"move"``, which renames
+``path`` to ``target``.
+"""
+
+OperationResult = namedtuple("OperationResult", "done failed removed added")
+OperationResult.__doc__ = """Outcome of ``apply_operations``.
+
+``failed`` holds ``(operation, message)`` pairs. ``removed`` and ``added``
+are the relative paths that disappeared and appeared, for
+``patch_listing``.
+"""
+
+
+def _targets(event):
+    target = event.get("target")
+    return target if isinstance(target, list) else [target]
+
+
+def plan_operations(events):
+    """Turn component events, one or a list, into ``FileOperation``s.
+
+    Events other than ``OPERATION_EVENTS`` are skipped, as are deletions
+    under a folder that is deleted too.
+    """
+    operations = []
+    for event in events if isinstance(events, list) else [events]:
+        if not isinstance(event, dict) or event.get("type") not in OPERATION_EVENTS:
+            continue
+        kind = event["type"]
+        for target in _targets(event):
+            path = target["path"].strip("/")
+            if kind in ("DELETE_FILE", "DELETE_FOLDER"):
+                operations.append(FileOperation("delete", path, None))
+            elif kind == "CREATE_FOLDER":
+                operations.append(FileOperation("mkdir", path, None))
+            elif kind == "RENAME_FILE":
+                # the file keeps its folder, ``name`` is its old name
+                source = posixpath.join(posixpath.dirname(path), target["name"])
+                operations.append(FileOperation("move", source, path))
+            else:
+                operations.append(FileOperation("move", target["name"].strip("/"), path))
+
+    deleted = tuple(f"{op.path}/" for op in operations if op.kind == "delete")
+    return [op for op in operations if not (op.kind == "delete" and op.path.startswith(deleted))]
+
+
+def _resolve(root, rel_path):
+    # The parent is resolved, so a path through a symlink cannot leave
+    # ``root``, while a symlink itself is deleted or moved, not its target.
+    parent, name = os.path.split(os.path.normpath(os.path.join(root, rel_path)))
+    parent = os.path.realpath(parent)
+    if name in ("", ".", "..") or (parent != root and not parent.startswith(root + os.sep)):
+        raise ValueError(f"{rel_path!r} is outside of {root}")
+    return os.path.join(parent, name)
+
+
+def _move(source, target):
+    # ``os.rename`` replaces existing files on POSIX, never do that silently
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "Target exists", target)
+    try:
+        os.rename(source, target)
+    except FileNotFoundError:
+        if not os.path.lexists(source):
+            raise
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # another file system, copy and delete
+        shutil.move(source, target)
+
+
+def _apply(root, op):
+    path = _resolve(root, op.path)
+    if op.kind == "delete":
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    elif op.kind == "mkdir":
+        os.makedirs(path, exist_ok=True)
+    elif op.kind == "move":
+        _move(path, _resolve(root, op.target))
+    else:
+        raise ValueError(f"unknown operation {op.kind!r}")
+
+
+def _apply_batch(root, batch):
+    failed = []
+    for op in batch:
+        try:
+            _apply(root, op)
+        except (OSError, ValueError) as e:
+            failed.append((op, str(e)))
+    return batch, failed
+
+
+def _ancestors(path):
+    parts = path.split("/")
+    return ["/".join(parts[: i + 1]) for i in range(len(parts))]
+
+
+def _dependent_chains(operations):
+    """Group ``operations`` that touch the same paths, or paths below another.
+
+    Each chain keeps the submission order, e.g. a folder is created before
+    something is moved into it, and chains are independent of each other.
+    """
+    owner = list(range(len(operations)))
+
+    def find(i):
+        while owner[i] != i:
+            owner[i] = owner[owner[i]]
+            i = owner[i]
+        return i
+
+    touched, below = {}, {}
+    for i, op in enumerate(operations):
+        for path in (op.path, op.target):
+            if path is None:
+                continue
+            ancestors = _ancestors(path)
+            # an earlier operation on this path or a folder above it, or on
+            # something inside of it
+            for j in [touched.get(a) for a in ancestors] + [below.get(path)]:
+                if j is not None:
+                    owner[find(j)] = find(i)
+            touched[path] = i
+            for a in ancestors:
+                below[a] = i
+
+    chains = {}
+    for i, op in enumerate(operations):
+        chains.setdefault(find(i), []).append(op)
+    return list(chains.values())
+
+
+def apply_operations(root, operations, workers=8, progress=None):
+    """Apply ``operations`` below ``root`` and return an ``OperationResult``.
+
+    Operations run in batches on ``workers`` threads, those on the same
+    paths in one batch in the order given. Moves are a single ``rename``
+    unless they cross file systems, and never overwrite. Paths leaving
+    ``root`` fail. ``progress(done, total)`` is called from the calling
+    thread after every batch, so it may update Streamlit elements.
+    """
+    root = os.path.realpath(root)
+    batches = [[]]
+    for chain in _dependent_chains(operations):
+        if batches[-1] and len(batches[-1]) + len(chain) > _BATCH_SIZE:
+            batches.append([])
+        batches[-1].extend(chain)
+    batches = [batch for batch in batches if batch]
+    done, failed = 0, []
+    with metrics.timer("operations.apply", operations=len(operations)) as m:
+        if not workers or workers <= 1 or len(batches) <= 1:
+            results = (_apply_batch(root, batch) for batch in batches)
+            executor = None
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="st-file-browser-ops"
+            )
+            results = (
+                future.result()
+                for future in as_completed(
+                    [executor.submit(_apply_batch, root, batch) for batch in batches]
+                )
+            )
+        try:
+            for batch, batch_failed in results:
+                done += len(batch)
+                failed.extend(batch_failed)
+                if progress is not None:
+                    progress(done, len(operations))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        m["failed"] = len(failed)
+
+    failed_ops = {op for op, _ in failed}
+    removed, added = set(), set()
+    for op in operations:
+        if op in failed_ops:
+            continue
+        if op.kind == "delete":
+            removed.add(op.path)
+        elif op.kind == "mkdir":
+            added.add(op.path)
+        else:
+            removed.add(op.path)
+            added.add(op.target)
+    return OperationResult(done - len(failed), failed, removed, added)
@@ -0,0 +1,106 @@
+import threading
+from importlib import import_module
+from collections.abc import MutableMapping
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # Python < 3.8
+    entry_points = None
+
+ENTRY_POINT_GROUP = "streamlit_file_browser.previews"
+
+
+def _resolve(handler):
+    """Import a ``"module:function"`` reference or load an entry point."""
+    if isinstance(handler, str):
+        module, _, attr = handler.partition(":")
+        handler = import_module(module)
+        for name in attr.split(".") if attr else ():
+            handler = getattr(handler, name)
+        return handler
+    if not callable(handler) and hasattr(handler, "load"):
+        return handler.load()
+    return handler
+
+
+def _group_entry_points(group):
+    if entry_points is None:
+        return ()
+    found = entry_points()
+    if hasattr(found, "select"):
+        return found.select(group=group)
+    return found.get(group, ())  # Python < 3.10
+
+
+class PreviewRegistry(MutableMapping):
+    """Preview handlers by file extension, imported on first use.
+
+    A handler is called as ``handler(root, file_path, url, **kwargs)``. It
+    may be registered as a ``"module:function"`` reference, which is only
+    imported the first time a file with its extension is previewed, so apps
+    that never preview a format never pay for its dependencies.
+
+    Packages add handlers through the ``streamlit_file_browser.previews``
+    entry point group, named by extension::
+
+        [project.entry-points."streamlit_file_browser.previews"]
+        ".foo" = "my_package.previews:show_foo"
+
+    Entry points are looked up on the first preview of an extension that
+    is not registered in code.
+    """
+
+    def __init__(self, handlers=None, group=ENTRY_POINT_GROUP):
+        self.group = group
+        self._handlers = {}
+        self._entry_points = None
+        self._lock = threading.Lock()
+        self.update(handlers or {})
+
+    def register(self, extensions, handler):
+        """Register ``handler`` for one extension or a sequence of them."""
+        for ext in [extensions] if isinstance(extensions, str) else extensions:
+            self[ext] = handler
+        return handler
+
+    def _discover(self):
+        with self._lock:
+            if self._entry_points is None:
+                found = {}
+                try:
+                    for entry_point in _group_entry_points(self.group):
+                        found.setdefault(entry_point.name, entry_point)
+                except Exception:
+                    # broken distribution metadata must not break previews
+                    pass
+                self._entry_points = found
+            return self._entry_points
+
+    def __getitem__(self, ext):
+        handler = self._handlers.get(ext)
+        if handler is None:
+            handler = self._discover().get(ext)
+            if handler is None:
+                raise KeyError(ext)
+        if isinstance(handler, str) or not callable(handler):
+            handler = _resolve(handler)
+            with self._lock:
+                self._handlers[ext] = handler
+        return handler
+
+    def __contains__(self, ext):
+        return ext in self._handlers or ext in self._discover()
+
+    def __setitem__(self, ext, handler):
+        with self._lock:
+            self._handlers[ext] = handler
+
+    def __delitem__(self, ext):
+        with self._lock:
+            del self._handlers[ext]
+
+    def __iter__(self):
+        return iter({**self._discover(), **self._handlers})
+
+    def __len__(self):
+        return len({**self._discover(), **self._handlers})
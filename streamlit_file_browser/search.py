@@ -0,0 +1,375 @@
+import os
+import re
+import time
+import heapq
+import struct
+import threading
+from array import array
+
+import numpy as np
+from wcmatch import fnmatch
+
+from .cache import _overlaps
+from .listing import ListingBuilder
+from .tree import CACHE_FILE_NAME, TreeIndex, _TreeFilter, cached_tree_index, write_cache_file
+from .watch import watch_tree
+
+SEARCH_CACHE_FILE_NAME = f"{CACHE_FILE_NAME}.search"
+SEARCH_CACHE_VERSION = 1
+# magic, format version, number of file slots, directories and trigrams
+_SEARCH_HEADER = struct.Struct("<6sHQQQ")
+_SEARCH_MAGIC = b"STSRCH"
+_GLOB_CHARS = frozenset("*?[")
+_LITERAL_RE = re.compile(r"[^*?\[\]]+")
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """Trigram index over the file names of a ``TreeIndex``.
+
+    The files of a directory get consecutive ids, in listing order, and
+    each trigram of a lower cased name a posting of its id. Ids only grow,
+    so postings stay sorted and are intersected with NumPy. Directory paths
+    are few and matched by a plain scan.
+
+    ``sync`` reindexes only the directories the ``TreeIndex`` rescanned
+    since the last call. Removed files leave holes that are compacted away
+    once they outnumber the live files.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.names = []  # id -> lower cased name, None once removed
+        self.dir_of = []  # id -> directory
+        self.postings = {}
+        # directory -> [first id, count, files list indexed, mtime, scanned]
+        self.dirs = {}
+        self.holes = 0
+        self.dirty = False
+
+    @property
+    def cache_path(self):
+        return os.path.join(self.root, SEARCH_CACHE_FILE_NAME)
+
+    def __len__(self):
+        return len(self.names) - self.holes
+
+    def sync(self, tree_index):
+        """Catch up with the directories of ``tree_index``, return whether anything changed."""
+        changed = False
+        for rel_dir, entry in tree_index.dirs.items():
+            files = entry["files"]
+            known = self.dirs.get(rel_dir)
+            if known is not None:
+                if known[2] is files:
+                    continue
+                if known[2] is None and known[3:] == [entry["mtime"], entry["scanned"]]:
+                    # loaded from disk, take over the identical listing
+                    known[2] = files
+                    continue
+                self._remove(known)
+            self.dirs[rel_dir] = [
+                self._add(rel_dir, [row[0] for row in files]),
+                len(files),
+                files,
+                entry["mtime"],
+                entry["scanned"],
+            ]
+            changed = True
+        for rel_dir in self.dirs.keys() - tree_index.dirs.keys():
+            self._remove(self.dirs.pop(rel_dir))
+            changed = True
+        if self.holes > len(self):
+            self._compact()
+        self.dirty = self.dirty or changed
+        return changed
+
+    def _add(self, rel_dir, names):
+        first = len(self.names)
+        postings = self.postings
+        for file_id, name in enumerate(names, first):
+            name = name.lower()
+            self.names.append(name)
+            for gram in trigrams(name):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("i")
+                posting.append(file_id)
+        self.dir_of.extend([rel_dir] * len(names))
+        return first
+
+    def _remove(self, known):
+        first, count = known[0], known[1]
+        self.names[first:first + count] = [None] * count
+        self.holes += count
+
+    def _compact(self):
+        live = [
+            (rel_dir, self.names[known[0]:known[0] + known[1]], known)
+            for rel_dir, known in self.dirs.items()
+        ]
+        self.names, self.dir_of, self.postings = [], [], {}
+        self.holes = 0
+        for rel_dir, names, known in live:
+            known[0] = self._add(rel_dir, names)
+        self.dirty = True
+
+    def _name_candidates(self, literal):
+        """Ids whose name may contain ``literal``, None when any may."""
+        grams = trigrams(literal)
+        if not grams:
+            return None
+        postings = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(np.frombuffer(posting, dtype=np.int32))
+        postings.sort(key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            result = np.intersect1d(result, posting, assume_unique=True)
+            if not len(result):
+                break
+        return result.tolist()
+
+    def search(self, pattern):
+        """Ids of the files matching ``pattern``, in id order.
+
+        Matching is that of ``Listing.search``: a case insensitive substring
+        of the path, or a glob on the name (on the path if it has a ``/``).
+        """
+        pattern = pattern.lower()
+        is_glob = not _GLOB_CHARS.isdisjoint(pattern)
+        if "/" in pattern:
+            return self._scan(pattern, is_glob)
+        if is_glob:
+            # the longest literal run narrows the candidates, the glob decides
+            literal = max(_LITERAL_RE.findall(pattern), key=len, default="")
+            matches = fnmatch.compile(pattern, flags=fnmatch.IGNORECASE).match
+        else:
+            literal = pattern
+            matches = lambda name: pattern in name  # noqa: E731
+
+        candidates = self._name_candidates(literal)
+        if candidates is None:
+            candidates = range(len(self.names))
+        names = self.names
+        found = {i for i in candidates if names[i] is not None and matches(names[i])}
+        if not is_glob:
+            # a substring of a path is in its name or in its directory
+            for rel_dir, known in self.dirs.items():
+                if pattern in rel_dir.lower():
+                    found.update(range(known[0], known[0] + known[1]))
+        return sorted(found)
+
+    def _scan(self, pattern, is_glob):
+        if is_glob:
+            matches = fnmatch.compile(pattern, flags=fnmatch.IGNORECASE).match
+        else:
+            matches = lambda path: pattern in path  # noqa: E731
+        found = []
+        for rel_dir, known in self.dirs.items():
+            prefix = f"{rel_dir.lower()}/" if rel_dir else ""
+            first = known[0]
+            for offset, name in enumerate(self.names[first:first + known[1]]):
+                if matches(prefix + name):
+                    found.append(first + offset)
+        found.sort()
+        return found
+
+    def entries(self, ids, tree_index):
+        """Yield ``(rel_dir, row)`` of ``ids`` from the synced ``tree_index``."""
+        for file_id in ids:
+            rel_dir = self.dir_of[file_id]
+            known = self.dirs[rel_dir]
+            yield rel_dir, tree_index.dirs[rel_dir]["files"][file_id - known[0]]
+
+    @classmethod
+    def load(cls, root):
+        index = cls(root)
+        try:
+            with open(index.cache_path, "rb") as cache_file:
+                index._unpack(cache_file.read())
+        except (OSError, ValueError, struct.error):
+            # missing or unreadable, rebuilt by the next ``sync``
+            index = cls(root)
+        return index
+
+    def save(self):
+        if not self.dirty:
+            return
+        if self.holes:
+            self._compact()
+        if write_cache_file(self.cache_path, self._pack()):
+            self.dirty = False
+
+    def _pack(self):
+        # Header, per directory mtime, scan time and file count, posting
+        # lengths and ids, then NUL separated directories, trigrams and names.
+        # Directories are written in id order, so ids are implied on load.
+        rel_dirs = sorted(self.dirs, key=lambda d: self.dirs[d][0])
+        grams = list(self.postings)
+        ids = array("i")
+        for gram in grams:
+            ids.extend(self.postings[gram])
+        strings = "\0".join([*rel_dirs, *grams, *self.names])
+        return b"".join(
+            [
+                _SEARCH_HEADER.pack(
+                    _SEARCH_MAGIC, SEARCH_CACHE_VERSION, len(self.names), len(rel_dirs), len(grams)
+                ),
+                np.array(
+                    [
+                        [self.dirs[d][3] for d in rel_dirs],
+                        [self.dirs[d][4] for d in rel_dirs],
+                        [self.dirs[d][1] for d in rel_dirs],
+                    ],
+                    dtype="<i8",
+                ).tobytes(),
+                np.array([len(self.postings[g]) for g in grams], dtype="<i8").tobytes(),
+                np.frombuffer(ids, dtype=np.int32).astype("<i4").tobytes(),
+                strings.encode("utf-8", "surrogateescape"),
+            ]
+        )
+
+    def _unpack(self, data):
+        magic, version, n_files, n_dirs, n_grams = _SEARCH_HEADER.unpack_from(data)
+        if magic != _SEARCH_MAGIC or version != SEARCH_CACHE_VERSION:
+            raise ValueError("not a search cache of this version")
+        lengths_offset = _SEARCH_HEADER.size + 24 * n_dirs
+        ids_offset = lengths_offset + 8 * n_grams
+        lengths = np.frombuffer(data, "<i8", n_grams, lengths_offset)
+        ends = np.cumsum(lengths).tolist()
+        strings_offset = ids_offset + 4 * (ends[-1] if ends else 0)
+        strings = data[strings_offset:].decode("utf-8", "surrogateescape").split("\0")
+        if len(strings) != max(n_dirs + n_grams + n_files, 1):
+            raise ValueError("truncated search cache")
+        dir_columns = np.frombuffer(data, "<i8", 3 * n_dirs, _SEARCH_HEADER.size).reshape(3, n_dirs)
+        ids = np.frombuffer(data, "<i4", ends[-1] if ends else 0, ids_offset).astype(np.int32)
+
+        rel_dirs = strings[:n_dirs]
+        first = 0
+        for rel_dir, mtime, scanned, count in zip(rel_dirs, *dir_columns.tolist()):
+            self.dirs[rel_dir] = [first, count, None, mtime, scanned]
+            self.dir_of.extend([rel_dir] * count)
+            first += count
+        self.names = strings[n_dirs + n_grams:n_dirs + n_grams + n_files]
+        for gram, begin, end in zip(strings[n_dirs:n_dirs + n_grams], [0] + ends[:-1], ends):
+            self.postings[gram] = array("i", ids[begin:end].tobytes())
+
+
+class _TreeSearch:
+    def __init__(self, root, use_cache):
+        self.use_cache = use_cache
+        if use_cache:
+            # the snapshot of the tree cache, listings walk it too
+            self.tree_lock, self.tree_index = cached_tree_index(root)
+        else:
+            self.tree_lock, self.tree_index = threading.Lock(), TreeIndex(root)
+        self.index = SearchIndex.load(root) if use_cache else SearchIndex(root)
+        self.refreshed = None
+        self.lock = threading.Lock()
+
+    def refresh(self, max_age):
+        """Bring the index up to date, called holding ``tree_lock``."""
+        now = time.monotonic()
+        if self.refreshed is None or now - self.refreshed >= max_age:
+            # Validates every known directory against its mtime and scans
+            # new ones.
+            for _ in self.tree_index.walk():
+                pass
+            self.refreshed = now
+        # the search index only follows what was rescanned, also by listings
+        self.index.sync(self.tree_index)
+        if self.use_cache:
+            self.tree_index.save()
+            self.index.save()
+
+
+_searches = {}
+_searches_lock = threading.Lock()
+
+
+def search_tree(
+    root,
+    pattern,
+    glob_patterns=("**/*",),
+    file_ignores=None,
+    limit=100,
+    use_cache=False,
+    use_watcher=False,
+    max_age=10.0,
+):
+    """Find the files of ``root`` matching ``pattern`` without walking it.
+
+    ``pattern`` is a case insensitive path fragment, or a glob on the name
+    such as ``*_final_model.pdb``, as for ``Listing.search``. Matches go
+    through ``glob_patterns`` and ``file_ignores`` like a listing and up to
+    ``limit`` of them are returned as a ``Listing`` in path order.
+
+    The index lives per root and ``use_cache`` for the whole process.
+    Without a watcher its tree is revalidated at most every ``max_age``
+    seconds. With ``use_cache`` it shares the snapshot of the tree cache
+    with listings and is kept next to it, so a restart only reindexes what
+    changed. With ``use_watcher`` it follows the watcher.
+    """
+    root = os.path.realpath(root)
+    key = (root, bool(use_cache))
+    with _searches_lock:
+        tree_search = _searches.get(key)
+        if tree_search is None:
+            tree_search = _searches[key] = _TreeSearch(root, use_cache)
+
+    with tree_search.lock:
+        if use_watcher:
+            watcher = watch_tree(root)
+            with watcher.lock:
+                tree_index = watcher.index
+                # known directories come straight from the snapshot
+                for _ in tree_index.walk():
+                    pass
+                tree_search.index.sync(tree_index)
+                matches = _visible_matches(tree_search.index, tree_index, pattern, glob_patterns, file_ignores)
+        else:
+            with tree_search.tree_lock:
+                tree_search.refresh(max_age)
+                tree_index = tree_search.tree_index
+                matches = _visible_matches(
+                    tree_search.index, tree_index, pattern, glob_patterns, file_ignores
+                )
+
+    builder = ListingBuilder()
+    dir_ids = {}
+    for _, rel_dir, row in heapq.nsmallest(limit, matches):
+        dir_id = dir_ids.get(rel_dir)
+        if dir_id is None:
+            dir_id = dir_ids[rel_dir] = builder.add_dir(rel_dir)
+        builder.add(dir_id, row)
+    return builder.build()
+
+
+def invalidate_search(path=None):
+    """Revalidate the search indexes of roots overlapping ``path`` on their next query."""
+    path = os.path.realpath(path) if path is not None else None
+    with _searches_lock:
+        for (root, _), tree_search in _searches.items():
+            if path is None or _overlaps(root, path):
+                tree_search.refreshed = None
+
+
+def _visible_matches(index, tree_index, pattern, glob_patterns, file_ignores):
+    """``(path, rel_dir, row)`` of the matches a listing would show."""
+    tree_filter = _TreeFilter(glob_patterns, file_ignores)
+    matches = []
+    for rel_dir, row in index.entries(index.search(pattern), tree_index):
+        if tree_filter.walk_state(rel_dir) == tree_filter.pruner.SKIP:
+            continue
+        name = row[0]
+        path = f"{rel_dir}/{name}" if rel_dir else name
+        if not tree_filter.ignored(name) and tree_filter.match_file(path, name):
+            matches.append((path, rel_dir, row))
+    return matches
@@ -0,0 +1,518 @@
+import io
+import os
+import re
+import hashlib
+import secrets
+import mimetypes
+import threading
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from .archive import ARCHIVE_FORMATS, archive_entries, archive_name, write_tar, write_zip
+from .metrics import metrics
+from .thumbnails import THUMBNAIL_SIZE, get_thumbnail_service
+from .tree import UPLOAD_SUFFIX, split_file_ignores
+
+_COPY_CHUNK = 256 * 1024
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+_CONTENT_RANGE_RE = re.compile(r"bytes (?:(\d+)-(\d+)|\*)/(\d+)")
+# a thumbnail request waits this long for its render
+THUMBNAIL_TIMEOUT = 30
+THUMBNAIL_MAX_SIZE = 1024
+
+
+def parse_range(header, size):
+    """Parse a single ``Range`` header into an inclusive ``(start, end)``.
+
+    Returns None for a missing or multi range header, which is answered
+    with the whole file, and raises ValueError when unsatisfiable.
+    """
+    m = _RANGE_RE.fullmatch((header or "").strip())
+    if not m or not (m[1] or m[2]):
+        return None
+    if not m[1]:
+        start, end = max(0, size - int(m[2])), size - 1
+    else:
+        start = int(m[1])
+        end = min(int(m[2]), size - 1) if m[2] else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"unsatisfiable range {header!r} for {size} bytes")
+    return start, end
+
+
+def parse_content_range(header):
+    """Parse the ``Content-Range`` of an upload chunk into ``(start, end, total)``."""
+    m = _CONTENT_RANGE_RE.fullmatch((header or "").strip())
+    if m and m[1] is None and m[3] == "0":
+        # ``bytes */0`` uploads an empty file
+        return 0, -1, 0
+    if not m or m[1] is None:
+        raise ValueError(f"invalid Content-Range {header!r}")
+    start, end, total = map(int, m.groups())
+    if start > end or end >= total:
+        raise ValueError(f"invalid Content-Range {header!r}")
+    return start, end, total
+
+
+def upload_part_path(abs_path):
+    """Where the chunks of an upload to ``abs_path`` are collected."""
+    directory, name = os.path.split(abs_path)
+    return os.path.join(directory, f".{name}{UPLOAD_SUFFIX}")
+
+
+_upload_listeners = []
+
+
+def add_upload_listener(listener):
+    """Call ``listener(root, rel_path)`` after each completed upload."""
+    _upload_listeners.append(listener)
+    return listener
+
+
+class _ChunkedWriter(io.RawIOBase):
+    """Write HTTP/1.1 chunks of a body whose length is not known up front."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n" % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+            self.written += len(data)
+        return len(data)
+
+    def finish(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    """Serve registered roots under ``/files/<token>/`` and ``/download/<token>/``.
+
+    ``/archive/<token>/<folder>`` streams the folder, or the ``path`` query
+    parameters below the root, as a ZIP (or ``format=tar``) built on the
+    fly, without the files ignored by the ``file_ignores`` of the token. ``/thumbnail/<token>/<path>`` answers a JPEG thumbnail of an image,
+    video or PDF (``size`` pixels, 256 by default) rendered by the
+    ``ThumbnailService``. Roots registered as writable also take chunked,
+    resumable uploads: ``PUT /upload/<token>/<path>`` appends one chunk
+    given by its ``Content-Range``, optionally checked against
+    ``X-Chunk-Sha256``, and ``HEAD`` answers the ``Upload-Offset`` to resume
+    from. The last chunk may carry ``X-Content-Sha256`` of the whole file.
+    Only roots registered on the server are reachable, by their random
+    token, and paths resolving outside of them are refused.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        route, root, rel_path = self.resolve()
+        if route == "files":
+            self.send_file(root, rel_path, head=head)
+        elif route == "download":
+            self.send_file(root, rel_path, head=head, attachment=True)
+        elif route == "archive":
+            self.send_archive(
+                root, rel_path, self.server.archive_ignores.get(self.token), head=head
+            )
+        elif route == "thumbnail":
+            self.send_thumbnail(root, rel_path, head=head)
+        elif route == "upload" and head:
+            self.send_upload_offset(root, rel_path)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def do_OPTIONS(self):
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, PUT, OPTIONS")
+        self.send_header(
+            "Access-Control-Allow-Headers",
+            "Content-Range, Content-Type, X-Chunk-Sha256, X-Content-Sha256",
+        )
+        self.send_header("Content-Length", "0")
+        self.send_cors_headers()
+        self.end_headers()
+
+    def do_PUT(self):
+        route, root, rel_path = self.resolve()
+        if route != "upload":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.receive_upload(root, rel_path)
+
+    def resolve(self):
+        parts = unquote(urlsplit(self.path).path).lstrip("/").split("/", 2)
+        if len(parts) < 2:
+            return None, None, None
+        root = self.server.roots.get(parts[1])
+        self.token = parts[1]
+        return parts[0], root, parts[2] if len(parts) > 2 else ""
+
+    def safe_path(self, root, rel_path):
+        if root is None:
+            return None
+        abs_path = os.path.realpath(os.path.join(root, rel_path))
+        if abs_path != root and not abs_path.startswith(root + os.sep):
+            return None
+        return abs_path
+
+    def send_cors_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header(
+            "Access-Control-Expose-Headers", "Content-Range, Content-Length, Upload-Offset"
+        )
+
+    def send_status(self, status, upload_offset=None, message=None):
+        body = (message or status.phrase).encode("utf-8")
+        self.send_response(status)
+        if upload_offset is not None:
+            self.send_header("Upload-Offset", str(upload_offset))
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def upload_path(self, root, rel_path):
+        """The target of an upload to ``rel_path``, if ``root`` takes uploads."""
+        if root not in self.server.writable_roots or not rel_path or rel_path.endswith("/"):
+            return None
+        abs_path = self.safe_path(root, rel_path)
+        return None if abs_path == root else abs_path
+
+    def send_upload_offset(self, root, rel_path):
+        abs_path = self.upload_path(root, rel_path)
+        if abs_path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            offset = os.path.getsize(upload_part_path(abs_path))
+        except OSError:
+            offset = 0
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Upload-Offset", str(offset))
+        self.send_header("Content-Length", "0")
+        self.send_cors_headers()
+        self.end_headers()
+
+    def receive_upload(self, root, rel_path):
+        abs_path = self.upload_path(root, rel_path)
+        if abs_path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            start, end, total = parse_content_range(self.headers.get("Content-Range"))
+            length = int(self.headers.get("Content-Length", -1))
+            if length != end - start + 1:
+                raise ValueError("Content-Length does not match Content-Range")
+        except ValueError as e:
+            self.close_connection = True
+            self.send_status(HTTPStatus.BAD_REQUEST, message=str(e))
+            return
+        part_path = upload_part_path(abs_path)
+        lock = self.server.upload_lock(part_path)
+        if not lock.acquire(blocking=False):
+            self.close_connection = True
+            self.send_status(HTTPStatus.CONFLICT, message="Upload in progress")
+            return
+        try:
+            with metrics.timer("server.upload_chunk", bytes=length):
+                status, offset, message = self.write_chunk(
+                    abs_path, part_path, start, end, total
+                )
+        finally:
+            # before answering, the client may send the next chunk right away
+            lock.release()
+        if status == HTTPStatus.CREATED:
+            for listener in list(_upload_listeners):
+                listener(root, os.path.relpath(abs_path, root).replace(os.sep, "/"))
+        try:
+            self.send_status(status, offset, message)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def write_chunk(self, abs_path, part_path, start, end, total):
+        """Append one chunk, return ``(status, upload_offset, message)``."""
+        try:
+            offset = os.path.getsize(part_path)
+        except OSError:
+            offset = 0
+        if start != offset or os.path.lexists(abs_path):
+            # the body is not read, drop the connection after answering
+            self.close_connection = True
+            if os.path.lexists(abs_path):
+                return HTTPStatus.CONFLICT, None, "File exists"
+            return HTTPStatus.CONFLICT, offset, "Resume from Upload-Offset"
+
+        expected = self.headers.get("X-Chunk-Sha256")
+        digest = hashlib.sha256()
+        remaining = end - start + 1
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        with open(part_path, "ab") as f:
+            try:
+                while remaining > 0:
+                    data = self.rfile.read(min(_COPY_CHUNK, remaining))
+                    if not data:
+                        break
+                    f.write(data)
+                    digest.update(data)
+                    remaining -= len(data)
+            except (ConnectionResetError, TimeoutError):
+                pass
+            if remaining > 0:
+                # a checked chunk is all or nothing, an unchecked one resumes where it broke
+                self.close_connection = True
+                if expected:
+                    f.truncate(start)
+                    return HTTPStatus.BAD_REQUEST, start, "Incomplete chunk"
+                return HTTPStatus.BAD_REQUEST, end + 1 - remaining, "Incomplete chunk"
+            if expected and digest.hexdigest() != expected.lower():
+                f.truncate(start)
+                return HTTPStatus.BAD_REQUEST, start, "Chunk checksum mismatch"
+            offset = end + 1
+
+        if offset < total:
+            return HTTPStatus.OK, offset, None
+        expected = self.headers.get("X-Content-Sha256")
+        if expected and _file_sha256(part_path) != expected.lower():
+            os.remove(part_path)
+            return HTTPStatus.BAD_REQUEST, 0, "File checksum mismatch"
+        os.rename(part_path, abs_path)
+        return HTTPStatus.CREATED, offset, None
+
+    def send_file(self, root, rel_path, head=False, attachment=False):
+        abs_path = self.safe_path(root, rel_path)
+        if abs_path is None or not os.path.isfile(abs_path):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with open(abs_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            try:
+                byte_range = parse_range(self.headers.get("Range"), size)
+            except ValueError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.send_cors_headers()
+                self.end_headers()
+                return
+            start, end = byte_range or (0, size - 1)
+            self.send_response(HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK)
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header(
+                "Content-Type", mimetypes.guess_type(abs_path)[0] or "application/octet-stream"
+            )
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+            self.send_header("ETag", f'"{stat.st_mtime_ns:x}-{size:x}"')
+            if attachment:
+                filename = quote(os.path.basename(abs_path))
+                self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{filename}")
+            self.send_cors_headers()
+            self.end_headers()
+            if head:
+                return
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(_COPY_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # players drop connections when seeking, nothing to report
+                self.close_connection = True
+
+
+    def send_archive(self, root, rel_path, file_ignores=None, head=False):
+        query = parse_qs(urlsplit(self.path).query)
+        rel_paths = query.get("path") or [rel_path]
+        fmt = (query.get("format") or ["zip"])[0]
+        if (
+            fmt not in ARCHIVE_FORMATS
+            or root is None
+            or any(self.safe_path(root, p) is None for p in rel_paths)
+        ):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/zip" if fmt == "zip" else "application/x-tar")
+        filename = quote(archive_name(rel_paths, fmt))
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{filename}")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_cors_headers()
+        self.end_headers()
+        if head:
+            return
+        body = _ChunkedWriter(self.wfile)
+        with metrics.timer("server.archive", format=fmt) as m:
+            try:
+                # buffered, the archive writers emit many small headers
+                with io.BufferedWriter(body, _COPY_CHUNK) as out:
+                    entries = archive_entries(root, rel_paths, file_ignores)
+                    (write_zip if fmt == "zip" else write_tar)(out, entries)
+                body.finish()
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+            m["bytes"] = body.written
+
+
+    def send_thumbnail(self, root, rel_path, head=False):
+        abs_path = self.safe_path(root, rel_path)
+        size = (parse_qs(urlsplit(self.path).query).get("size") or [str(THUMBNAIL_SIZE)])[0]
+        if abs_path is None or not os.path.isfile(abs_path) or not size.isdigit():
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        size = min(max(int(size), 16), THUMBNAIL_MAX_SIZE)
+        thumbnail = get_thumbnail_service().get(abs_path, size, timeout=THUMBNAIL_TIMEOUT)
+        try:
+            with open(thumbnail, "rb") as f:
+                data = f.read()
+        except (OSError, TypeError):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        # the component adds the file's mtime to the URL
+        self.send_header("Cache-Control", "max-age=86400")
+        self.send_cors_headers()
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_COPY_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileServer(ThreadingHTTPServer):
+    """A small threaded HTTP server for previews and downloads.
+
+    It plays the part of the Caddy ``file_server`` routes: files are
+    streamed with HTTP Range support instead of being pushed through the
+    Streamlit websocket. ``public_url`` is the address browsers use to reach
+    it, when that differs from the bound host and port (e.g. behind a proxy).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, public_url=None, handler=FileRequestHandler):
+        super().__init__((host, port), handler)
+        self.roots = {}
+        self.writable_roots = set()
+        self._tokens = {}
+        self.archive_ignores = {}
+        self._upload_locks = {}
+        self._lock = threading.Lock()
+        bound_host, bound_port = self.server_address[:2]
+        self.public_url = (public_url or f"http://{bound_host}:{bound_port}").rstrip("/")
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="st-file-browser-server", daemon=True)
+        thread.start()
+        return self
+
+    def register(self, root):
+        """Expose ``root`` and return its token."""
+        root = os.path.realpath(root)
+        with self._lock:
+            token = self._tokens.get(root)
+            if token is None:
+                token = self._tokens[root] = secrets.token_urlsafe(16)
+                self.roots[token] = root
+            return token
+
+    def upload_url(self, root):
+        """Base URL of uploads into ``root``, which makes ``root`` writable."""
+        token = self.register(root)
+        with self._lock:
+            self.writable_roots.add(self.roots[token])
+        return f"{self.public_url}/upload/{token}/"
+
+    def upload_lock(self, part_path):
+        with self._lock:
+            return self._upload_locks.setdefault(part_path, threading.Lock())
+
+    def archive_url(self, root, file_ignores=None):
+        """Base URL of the archive downloads of ``root``.
+
+        Archives leave out the files ``file_ignores`` hides from listings,
+        see ``st_file_browser``. Each set of rules gets a token of its own.
+        """
+        if not file_ignores:
+            return f"{self.public_url}/archive/{self.register(root)}/"
+        root = os.path.realpath(root)
+        key = (root, split_file_ignores(file_ignores))
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is None:
+                token = self._tokens[key] = secrets.token_urlsafe(16)
+                self.roots[token] = root
+                self.archive_ignores[token] = file_ignores
+        return f"{self.public_url}/archive/{token}/"
+
+    def thumbnail_url(self, root):
+        """Base URL of the thumbnails of the files of ``root``."""
+        return f"{self.public_url}/thumbnail/{self.register(root)}/"
+
+    def urls(self, root):
+        """Return ``(artifacts_site, artifacts_download_site)`` for ``root``."""
+        token = self.register(root)
+        return (
+            f"{self.public_url}/files/{token}/",
+            f"{self.public_url}/download/{token}/",
+        )
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_file_server(host=None, port=None, public_url=None):
+    """Return the process wide file server, starting it on first use.
+
+    Defaults come from ``STREAMLIT_FILE_BROWSER_SERVER_HOST``,
+    ``STREAMLIT_FILE_BROWSER_SERVER_PORT`` and
+    ``STREAMLIT_FILE_BROWSER_SERVER_PUBLIC_URL``, else an ephemeral port on
+    localhost. Arguments only apply to the first call.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = FileServer(
+                host or os.getenv("STREAMLIT_FILE_BROWSER_SERVER_HOST", "127.0.0.1"),
+                int(port or os.getenv("STREAMLIT_FILE_BROWSER_SERVER_PORT", 0)),
+                public_url or os.getenv("STREAMLIT_FILE_BROWSER_SERVER_PUBLIC_URL"),
+            ).start()
+        return _server
+
+
+def serve_files(root, **server_kwargs):
+    """Expose ``root`` on the built-in file server.
+
+    Returns ``(artifacts_site, artifacts_download_site)`` for
+    ``st_file_browser``.
+    """
+    return get_file_server(**server_kwargs).urls(root)
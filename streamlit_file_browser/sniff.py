@@ -0,0 +1,85 @@
+import os
+import threading
+from functools import lru_cache
+from collections import OrderedDict, namedtuple
+
+# filetype looks at up to 8 KiB, binaryornot at the first 512 bytes of it.
+HEADER_BYTES = 8192
+_BINARY_CHUNK = 512
+_MAX_ENTRIES = 8192
+
+FileSniff = namedtuple("FileSniff", "is_text mime kind")
+FileSniff.__doc__ = """Classification of a file from one read of its header.
+
+``kind`` is ``"image"``, ``"video"`` or ``"audio"`` when ``filetype``
+recognises the header, otherwise ``"text"`` or ``"binary"``.
+"""
+
+_sniffs = OrderedDict()
+_sniffs_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _detectors():
+    # imported on the first sniff, listing files does not need them
+    from binaryornot.helpers import is_binary_string
+    from filetype import audio_match, image_match, video_match
+
+    try:
+        from binaryornot.helpers import has_binary_extension
+    except ImportError:  # binaryornot < 0.5 only looks at the content
+        has_binary_extension = None
+    matchers = (("image", image_match), ("video", video_match), ("audio", audio_match))
+    return is_binary_string, has_binary_extension, matchers
+
+
+def sniff_header(path, header):
+    """Classify ``path`` from its already read ``header`` bytes."""
+    is_binary_string, has_binary_extension, matchers = _detectors()
+    is_text = not (
+        (has_binary_extension is not None and has_binary_extension(path))
+        or is_binary_string(header[:_BINARY_CHUNK])
+    )
+    for kind, match in matchers:
+        ft = match(header)
+        if ft:
+            return FileSniff(is_text, ft.mime, kind)
+    return FileSniff(is_text, "text/plain" if is_text else None, "text" if is_text else "binary")
+
+
+def sniff_file(path):
+    """Classify ``path`` reading its header once.
+
+    Results are memoised per (path, size, mtime), so classifying many files,
+    or the same file on every rerun, costs a ``stat`` once a file was seen.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _sniffs_lock:
+        result = _sniffs.get(key)
+        if result is not None:
+            _sniffs.move_to_end(key)
+            return result
+
+    with open(path, "rb") as f:
+        result = sniff_header(path, f.read(HEADER_BYTES))
+    with _sniffs_lock:
+        _sniffs[key] = result
+        while len(_sniffs) > _MAX_ENTRIES:
+            _sniffs.popitem(last=False)
+    return result
+
+
+def sniff_files(paths):
+    """Classify many files, returning ``{path: FileSniff}``.
+
+    Files that can not be read are left out.
+    """
+    results = {}
+    for path in paths:
+        try:
+            results[path] = sniff_file(path)
+        except OSError:
+            continue
+    return results
@@ -0,0 +1,160 @@
+import os
+import mmap
+import threading
+from array import array
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# A checkpoint is kept every CHECKPOINT_LINES lines, so reaching any line
+# costs at most that many ``find`` calls once the index covers it.
+CHECKPOINT_LINES = 1024
+_SCAN_CHUNK = 4 * 1024 * 1024
+_MAX_INDEXES = 64
+
+TextWindow = namedtuple("TextWindow", "text first_line lines truncated eof")
+
+
+class LineIndex:
+    """Byte offsets of every ``CHECKPOINT_LINES``-th line start of a file.
+
+    The index is extended lazily, only as far as the lines asked for, by
+    counting newlines over the mapped file a chunk at a time.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.checkpoints = array("Q", [0])
+        self.scanned_to = 0
+        self.newlines = 0
+
+    @property
+    def complete(self):
+        return self.scanned_to >= self.size
+
+    def _extend(self, mm, checkpoint):
+        while len(self.checkpoints) <= checkpoint and not self.complete:
+            end = min(self.scanned_to + _SCAN_CHUNK, self.size)
+            chunk = np.frombuffer(
+                mm, dtype=np.uint8, count=end - self.scanned_to, offset=self.scanned_to
+            )
+            found = np.flatnonzero(chunk == 10)
+            # newline i of this chunk starts line ``self.newlines + i + 1``
+            first = len(self.checkpoints) * CHECKPOINT_LINES - self.newlines - 1
+            if first < len(found):
+                starts = found[first::CHECKPOINT_LINES] + self.scanned_to + 1
+                self.checkpoints.extend(int(s) for s in starts if s < self.size)
+            self.newlines += len(found)
+            self.scanned_to = end
+
+    def line_start(self, mm, line):
+        """Byte offset where ``line`` (0 based) starts, None past the end."""
+        checkpoint, skip = divmod(line, CHECKPOINT_LINES)
+        self._extend(mm, checkpoint)
+        if len(self.checkpoints) <= checkpoint:
+            return None
+        pos = self.checkpoints[checkpoint]
+        for _ in range(skip):
+            pos = mm.find(b"\n", pos)
+            if pos == -1 or pos + 1 >= self.size:
+                return None
+            pos += 1
+        return pos
+
+    def line_count(self, mm):
+        self._extend(mm, float("inf"))
+        trailing = 0 if mm[self.size - 1 : self.size] == b"\n" else 1
+        return self.newlines + trailing
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _line_index(path, stat):
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = LineIndex(stat.st_size)
+            while len(_indexes) > _MAX_INDEXES:
+                _indexes.popitem(last=False)
+        _indexes.move_to_end(key)
+        return index
+
+
+def _open_mapped(path):
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            return stat, None
+        return stat, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _decode(data):
+    return data.decode("utf-8", errors="replace")
+
+
+def _count_lines(text):
+    return text.count("\n") + (0 if not text or text.endswith("\n") else 1)
+
+
+def read_lines(path, start=0, count=1000, max_bytes=4 * 1024 * 1024):
+    """Return ``count`` lines of ``path`` from line ``start`` (0 based).
+
+    The file is memory mapped and only the window is decoded. The newline
+    index is kept per (path, size, mtime) so paging through a file does not
+    rescan it. The window is cut at ``max_bytes``.
+    """
+    stat, mm = _open_mapped(path)
+    if mm is None:
+        return TextWindow("", start, 0, False, True)
+    with mm:
+        index = _line_index(path, stat)
+        with index.lock:
+            begin = index.line_start(mm, start)
+            if begin is None:
+                return TextWindow("", start, 0, False, True)
+            end = index.line_start(mm, start + count)
+        end = stat.st_size if end is None else end
+        truncated = end - begin > max_bytes
+        end = min(end, begin + max_bytes)
+        text = _decode(mm[begin:end])
+        return TextWindow(text, start, _count_lines(text), truncated, end >= stat.st_size)
+
+
+def read_tail(path, count=1000, max_bytes=4 * 1024 * 1024):
+    """Return the last ``count`` lines of ``path``, scanning back from the end."""
+    stat, mm = _open_mapped(path)
+    if mm is None:
+        return TextWindow("", 0, 0, False, True)
+    with mm:
+        size = stat.st_size
+        pos = size - 1 if mm[size - 1 : size] == b"\n" else size
+        floor = max(0, size - max_bytes)
+        for _ in range(count):
+            pos = mm.rfind(b"\n", floor, pos)
+            if pos == -1:
+                break
+        begin = floor if pos == -1 else pos + 1
+        text = _decode(mm[begin:size])
+        lines = _count_lines(text)
+        first_line = None
+        index = _line_index(path, stat)
+        if index.complete:
+            with index.lock:
+                first_line = index.line_count(mm) - lines
+        truncated = pos == -1 and floor > 0
+        return TextWindow(text, first_line, lines, truncated, True)
+
+
+def line_count(path):
+    """Count the lines of ``path``, completing its newline index."""
+    stat, mm = _open_mapped(path)
+    if mm is None:
+        return 0
+    with mm:
+        index = _line_index(path, stat)
+        with index.lock:
+            return index.line_count(mm)
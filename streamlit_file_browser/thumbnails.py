@@ -0,0 +1,295 @@
+import io
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .metrics import metrics
+
+THUMBNAIL_SIZE = 256
+# large image previews are shown at this size, not at full resolution
+PREVIEW_IMAGE_SIZE = 1600
+PREVIEW_IMAGE_MIN_BYTES = 2 * 1024 * 1024
+# a preview waits this long for its scaled copy, then shows the original
+PREVIEW_IMAGE_TIMEOUT = 2.0
+THUMBNAIL_CACHE_BYTES = 256 * 1024 * 1024
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tif", ".tiff")
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi")
+PDF_EXTENSIONS = (".pdf",)
+# scaled image previews keep animations as they are
+PREVIEW_IMAGE_EXTENSIONS = tuple(ext for ext in IMAGE_EXTENSIONS if ext != ".gif")
+
+
+def thumbnail_cache_dir():
+    """Directory of rendered thumbnails.
+
+    ``STREAMLIT_FILE_BROWSER_THUMBNAIL_CACHE`` if set, else a folder in the
+    system temp directory.
+    """
+    return os.getenv("STREAMLIT_FILE_BROWSER_THUMBNAIL_CACHE") or os.path.join(
+        tempfile.gettempdir(), "st-file-browser-thumbnails"
+    )
+
+
+def _importable(module):
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=None)
+def thumbnail_extensions():
+    """Extensions thumbnails can be rendered for with what is installed.
+
+    Images need Pillow, videos ``ffmpeg`` on the ``PATH`` and PDFs
+    ``pypdfium2``.
+    """
+    if not _importable("PIL"):
+        return ()
+    extensions = IMAGE_EXTENSIONS
+    if shutil.which("ffmpeg"):
+        extensions += VIDEO_EXTENSIONS
+    if _importable("pypdfium2"):
+        extensions += PDF_EXTENSIONS
+    return extensions
+
+
+def _first_video_frame(src):
+    from PIL import Image
+
+    frame = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", src, "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+        stdout=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        check=True,
+        timeout=60,
+    ).stdout
+    return Image.open(io.BytesIO(frame))
+
+
+def _first_pdf_page(src, size):
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(src)
+    try:
+        page = pdf[0]
+        return page.render(scale=size / max(page.get_size())).to_pil()
+    finally:
+        pdf.close()
+
+
+def render_thumbnail(src, dst, size=THUMBNAIL_SIZE):
+    """Write a JPEG of ``src`` fitting ``size`` x ``size`` pixels to ``dst``.
+
+    Videos give their first frame, PDFs their first page. Runs in the worker
+    processes of ``ThumbnailService``.
+    """
+    from PIL import Image, ImageOps
+
+    ext = os.path.splitext(src)[1].lower()
+    if ext in VIDEO_EXTENSIONS:
+        image = _first_video_frame(src)
+    elif ext in PDF_EXTENSIONS:
+        image = _first_pdf_page(src, size)
+    else:
+        image = Image.open(src)
+        # JPEGs decode at a fraction of their size right away
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size))
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), suffix=".tmp")
+    os.close(fd)
+    try:
+        image.save(tmp, "JPEG", quality=80, optimize=True)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return dst
+
+
+class ThumbnailService:
+    """Render thumbnails on a process pool into a size bounded disk cache.
+
+    Thumbnails are named by the hash of the source path, size and mtime and
+    the thumbnail size, so a changed file gets a new one and the old one
+    ages out. Reads touch the file, once the cache holds more than
+    ``max_bytes`` the least recently read are removed. Concurrent requests
+    for one thumbnail share a single render.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=THUMBNAIL_CACHE_BYTES, workers=None):
+        self.cache_dir = cache_dir or thumbnail_cache_dir()
+        self.max_bytes = max_bytes
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._inflight = {}
+        self._bytes = None
+
+    def path_for(self, abs_path, size=THUMBNAIL_SIZE):
+        stat = os.stat(abs_path)
+        key = hashlib.sha1(
+            f"{os.path.abspath(abs_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{size}".encode("utf-8")
+        ).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.jpg")
+
+    def _pool(self):
+        if self._executor is None:
+            # Streamlit runs the app script as ``__main__``. Workers started
+            # with spawn, and forkserver ones too, import ``__main__`` before
+            # their first task and so run the whole app again, so on Linux
+            # they are forked. Forking a threaded server is only safe as
+            # long as workers run nothing but ``render_thumbnail``: its
+            # arguments are plain strings and ints, it opens its own files
+            # and never touches this service, its lock or any other state
+            # shared with the parent's threads. CPython resets its own
+            # import and logging locks after a fork. Callers wait with a
+            # timeout, so a worker that hangs regardless cannot block them.
+            method = "fork" if sys.platform.startswith("linux") else "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context(method)
+            )
+        return self._executor
+
+    def submit(self, abs_path, size=THUMBNAIL_SIZE):
+        """Return the cached thumbnail path, or a future of it.
+
+        None for files that have no thumbnail, see ``thumbnail_extensions``.
+        """
+        if multiprocessing.parent_process() is not None:
+            # a spawned worker running the app, see ``_pool``
+            return None
+        if not abs_path.lower().endswith(thumbnail_extensions()):
+            return None
+        try:
+            dst = self.path_for(abs_path, size)
+        except OSError:
+            return None
+        try:
+            os.utime(dst)
+            return dst
+        except OSError:
+            pass
+        with self._lock:
+            future = self._inflight.get(dst)
+            if future is not None:
+                return future
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                future = self._pool().submit(render_thumbnail, abs_path, dst, size)
+            except BrokenProcessPool:
+                # a worker died, e.g. killed for memory, start over next time
+                self._executor = None
+                return None
+            self._inflight[dst] = future
+        # outside the lock, it runs right away when the render is done already
+        future.add_done_callback(
+            lambda f, start=time.perf_counter(): self._rendered(dst, f, start)
+        )
+        return future
+
+    def get(self, abs_path, size=THUMBNAIL_SIZE, timeout=None):
+        """Return the path of the thumbnail of ``abs_path``, rendering it if needed.
+
+        Waits at most ``timeout`` seconds for a render, None if it did not
+        finish, failed or the file has no thumbnail.
+        """
+        result = self.submit(abs_path, size)
+        if result is None or isinstance(result, str):
+            return result
+        try:
+            return result.result(timeout)
+        except Exception:
+            # timed out, or the render failed, e.g. on a broken file
+            return None
+
+    def _rendered(self, dst, future, start):
+        with self._lock:
+            self._inflight.pop(dst, None)
+        failed = future.cancelled() or future.exception() is not None
+        metrics.record("thumbnail.render", time.perf_counter() - start, errors=int(failed))
+        if not failed:
+            try:
+                self._account(os.path.getsize(dst))
+            except OSError:
+                pass
+
+    def _account(self, nbytes):
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += nbytes
+            total = self._bytes
+        if total is None:
+            # first render of this process, count what earlier ones left
+            total = sum(size for _, size, _ in self._entries())
+        if total > self.max_bytes:
+            total = self.evict()
+        with self._lock:
+            self._bytes = total
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self, target=None):
+        """Remove the least recently read thumbnails until ``target`` bytes remain.
+
+        ``target`` defaults to 90% of ``max_bytes``. Returns the bytes left.
+        """
+        target = int(self.max_bytes * 0.9) if target is None else target
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_thumbnail_service():
+    """Return the process wide ``ThumbnailService``."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ThumbnailService()
+        return _service
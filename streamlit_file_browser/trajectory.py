@@ -0,0 +1,145 @@
+import os
+import json
+import struct
+import hashlib
+import tempfile
+from collections import namedtuple
+
+from .metrics import metrics
+
+# GROMACS 2023 writes the compressed size of large frames as 64 bits.
+XTC_MAGIC = 1995
+XTC_MAGIC_LARGE = 2023
+# magic, natoms, step, time, box (3x3), natoms again
+_XTC_HEADER = struct.Struct(">iiif9fi")
+# precision, minint (3), maxint (3), smallidx
+_XTC_COORD_HEADER = struct.Struct(">f7i")
+_COPY_CHUNK = 1024 * 1024
+
+PREVIEW_MAX_FRAMES = 200
+# trajectories below this are previewed as they are
+PREVIEW_MIN_BYTES = 32 * 1024 * 1024
+
+TrajectoryPreview = namedtuple("TrajectoryPreview", "path frames total_frames stride")
+TrajectoryPreview.__doc__ = """A downsampled trajectory for previews.
+
+``path`` holds every ``stride``-th of the ``total_frames`` frames of the
+source, ``frames`` in all.
+"""
+
+
+def trajectory_cache_dir():
+    """Directory of downsampled trajectories.
+
+    ``STREAMLIT_FILE_BROWSER_PREVIEW_CACHE`` if set, else a folder in the
+    system temp directory.
+    """
+    return os.getenv("STREAMLIT_FILE_BROWSER_PREVIEW_CACHE") or os.path.join(
+        tempfile.gettempdir(), "st-file-browser-previews"
+    )
+
+
+def xtc_frames(f):
+    """Yield ``(offset, length)`` of the frames of an open XTC file.
+
+    Only the frame headers are read, the coordinates are skipped by their
+    compressed size. Stops at the first frame that is truncated or does
+    not start with the XTC magic number.
+    """
+    size = os.fstat(f.fileno()).st_size
+    offset = 0
+    while True:
+        f.seek(offset)
+        header = f.read(_XTC_HEADER.size)
+        if len(header) < _XTC_HEADER.size:
+            return
+        values = _XTC_HEADER.unpack(header)
+        magic, natoms = values[0], values[1]
+        if magic not in (XTC_MAGIC, XTC_MAGIC_LARGE) or natoms < 0:
+            return
+        if natoms <= 9:
+            # small systems are stored uncompressed
+            length = _XTC_HEADER.size + natoms * 12
+        else:
+            size_format = ">Q" if magic == XTC_MAGIC_LARGE else ">i"
+            coords = f.read(_XTC_COORD_HEADER.size + struct.calcsize(size_format))
+            if len(coords) < _XTC_COORD_HEADER.size + struct.calcsize(size_format):
+                return
+            (nbytes,) = struct.unpack_from(size_format, coords, _XTC_COORD_HEADER.size)
+            length = _XTC_HEADER.size + len(coords) + (nbytes + 3) // 4 * 4
+        if offset + length > size:
+            return
+        yield offset, length
+        offset += length
+
+
+def _copy_range(src, dst, offset, length):
+    src.seek(offset)
+    while length > 0:
+        chunk = src.read(min(_COPY_CHUNK, length))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def downsample_xtc(src_path, dst_path, max_frames=PREVIEW_MAX_FRAMES):
+    """Write every n-th frame of ``src_path`` to ``dst_path``, at most ``max_frames``.
+
+    Frames are copied as they are, without decompressing, so this costs a
+    read of the frame headers plus the kept frames. Returns ``(frames,
+    total_frames, stride)``.
+    """
+    with open(src_path, "rb") as src:
+        frames = list(xtc_frames(src))
+        stride = max(1, -(-len(frames) // max_frames))
+        kept = frames[::stride]
+        with open(dst_path, "wb") as dst:
+            for offset, length in kept:
+                _copy_range(src, dst, offset, length)
+    return len(kept), len(frames), stride
+
+
+def preview_trajectory(path, max_frames=PREVIEW_MAX_FRAMES, cache_dir=None):
+    """Return a ``TrajectoryPreview`` of the XTC trajectory ``path``.
+
+    The downsampled file is cached on disk under ``cache_dir`` (see
+    ``trajectory_cache_dir``), keyed by the source path, size and mtime, so
+    it is built once per version of the trajectory.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    cache_dir = cache_dir or trajectory_cache_dir()
+    key = hashlib.sha1(
+        f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0{max_frames}".encode("utf-8")
+    ).hexdigest()
+    preview_path = os.path.join(cache_dir, f"{key}.xtc")
+    # written last, a complete entry has it
+    meta_path = os.path.join(cache_dir, f"{key}.json")
+
+    with metrics.timer("preview.trajectory", bytes=stat.st_size) as m:
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if os.path.exists(preview_path):
+                m["cache_hit"] = True
+                return TrajectoryPreview(preview_path, **meta)
+        except (OSError, ValueError, TypeError):
+            pass
+
+        m["cache_hit"] = False
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".xtc.tmp")
+        os.close(fd)
+        try:
+            frames, total_frames, stride = downsample_xtc(path, tmp_path, max_frames)
+            os.replace(tmp_path, preview_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        meta = {"frames": frames, "total_frames": total_frames, "stride": stride}
+        with open(f"{tmp_path}.json", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{tmp_path}.json", meta_path)
+        m["preview_bytes"] = os.path.getsize(preview_path)
+        return TrajectoryPreview(preview_path, **meta)
@@ -0,0 +1,835 @@
+import os
+import re
+import mmap
+import stat
+import time
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from wcmatch import glob, fnmatch
+
+from .listing import Listing, ListingBuilder
+
+CACHE_FILE_NAME = ".st-tree.cache"
+# uploads in progress, next to their target as ``.<name>.st-upload``
+UPLOAD_SUFFIX = ".st-upload"
+CACHE_VERSION = 3
+# magic, format version, number of directories, files and sub directories
+_CACHE_HEADER = struct.Struct("<6sHQQQ")
+_CACHE_MAGIC = b"STTREE"
+
+# Directory mtimes are only trusted once they are older than this window,
+# otherwise a change landing in the same timestamp tick as our scan is missed.
+_RACY_WINDOW_NS = 2 * 10**9
+
+# Directories scanned ahead of the walk, per worker.
+_PREFETCH_PER_WORKER = 4
+# ``stat`` calls handed to a worker at a time.
+_STAT_CHUNK = 32
+
+
+def is_internal_file(name):
+    """Whether ``name`` is a file this package keeps in the browsed tree.
+
+    Listing and search caches, and uploads in progress.
+    """
+    return name.startswith(CACHE_FILE_NAME) or (
+        name.startswith(".") and name.endswith(UPLOAD_SUFFIX)
+    )
+
+
+def _entry_name(entry):
+    return entry.name if isinstance(entry, os.DirEntry) else entry[0]
+
+
+def _entry_row(entry):
+    stat = entry.stat()
+    return (entry.name, stat.st_size, stat.st_ctime, stat.st_mtime, stat.st_atime)
+
+
+def _stat_rows(entries):
+    rows = []
+    for entry in entries:
+        try:
+            rows.append(_entry_row(entry))
+        except OSError:
+            # vanished between readdir and stat, or a dangling symlink
+            continue
+    return rows
+
+
+def _run_in_order(futures, func, args):
+    # Results in submission order. Tasks no worker picked up yet are run by
+    # the caller, so a worker waiting here can not starve the pool.
+    for future, arg in zip(futures, args):
+        yield func(arg) if future.cancel() else future.result()
+
+
+def stat_entries(entries, executor=None):
+    """Return ``(name, size, ctime, mtime, atime)`` rows of ``os.DirEntry`` objects.
+
+    Entries that can not be stat'ed are dropped. With an ``executor`` the
+    calls are spread over its workers in chunks, rows keep the input order.
+    """
+    if executor is None or len(entries) <= _STAT_CHUNK:
+        return _stat_rows(entries)
+    chunks = [entries[i:i + _STAT_CHUNK] for i in range(0, len(entries), _STAT_CHUNK)]
+    futures = [executor.submit(_stat_rows, chunk) for chunk in chunks]
+    return [row for rows in _run_in_order(futures, _stat_rows, chunks) for row in rows]
+
+
+def scan_dir(abs_dir, with_stat=True, executor=None):
+    """List one directory as ``(files, dirs)``.
+
+    ``files`` holds ``(name, size, ctime, mtime, atime)`` rows, or the raw
+    ``os.DirEntry`` objects when ``with_stat`` is false so callers can stat
+    only what they keep. ``dirs`` holds the names of sub directories. Both
+    are sorted by name. Symlinked directories are not descended, like
+    ``wcmatch`` GLOBSTAR. ``executor`` is passed on to ``stat_entries``.
+    """
+    files, dirs = [], []
+    with os.scandir(abs_dir) as it:
+        for entry in it:
+            if is_internal_file(entry.name):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif not entry.is_dir():
+                    files.append(entry)
+            except OSError:
+                continue
+    files.sort(key=_entry_name)
+    dirs.sort()
+    if with_stat:
+        files = stat_entries(files, executor)
+    return files, dirs
+
+
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+
+def write_cache_file(path, data):
+    """Atomically replace the cache file ``path`` with ``data``.
+
+    The data goes to a unique temp file next to it first, and writers of
+    one path in this process take turns, so concurrent sessions never
+    replace each other's files mid write. Returns False if the write
+    failed, the cache is then only behind, which must not break a render.
+    """
+    with _write_locks_lock:
+        lock = _write_locks.setdefault(path, threading.Lock())
+    directory, name = os.path.split(path)
+    with lock:
+        tmp_path = None
+        try:
+            # named like the cache, so listings skip it
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{name}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+    return True
+
+
+_cached_indexes = {}
+_cached_indexes_lock = threading.Lock()
+
+
+def cached_tree_index(root, rebuild=False):
+    """Return ``(lock, index)``, the process wide ``TreeIndex`` of ``root``'s cache file.
+
+    It is loaded once, then listings and searches with ``use_cache`` walk
+    and save this one snapshot while holding ``lock``, so the cache file
+    has a single writer. ``rebuild`` forgets what it knows first.
+    """
+    key = os.path.realpath(root)
+    with _cached_indexes_lock:
+        entry = _cached_indexes.get(key)
+        if entry is None:
+            entry = _cached_indexes[key] = (threading.Lock(), TreeIndex.load(root))
+    lock, index = entry
+    if rebuild:
+        with lock:
+            index.forget("")
+    return lock, index
+
+
+def file_info(rel_path, row):
+    _, size, ctime, mtime, atime = row
+    return {
+        "path": rel_path,
+        "size": size,
+        "create_time": ctime * 1000,
+        "update_time": mtime * 1000,
+        "access_time": atime * 1000,
+        "name": os.path.basename(rel_path.rstrip("/")),
+    }
+
+
+class TreeIndex:
+    """Per-directory snapshot of a tree, validated against directory mtimes.
+
+    Each directory is stored with the mtime it had when it was scanned.
+    ``listdir`` only rescans a directory whose mtime moved, so refreshing a
+    warm index costs one ``stat`` per directory plus a scan of the changed
+    ones. Note that editing a file in place does not touch its directory
+    mtime, so the cached size and times of such a file stay as scanned.
+
+    With ``validate=False`` known directories are returned without the
+    ``stat``, for owners that keep the snapshot current themselves through
+    ``refresh`` or ``update_path``.
+
+    ``listdir`` may be called from several threads for different
+    directories at once, as the parallel ``walk_tree`` does.
+    """
+
+    def __init__(self, root, validate=True):
+        self.root = os.path.abspath(root)
+        self.validate = validate
+        self.dirs = {}
+        self.dirty = False
+        self._lock = threading.RLock()
+
+    @property
+    def cache_path(self):
+        return os.path.join(self.root, CACHE_FILE_NAME)
+
+    @classmethod
+    def load(cls, root):
+        index = cls(root)
+        try:
+            with open(index.cache_path, "rb") as cache_file:
+                with mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    index.dirs = _unpack_index(buffer)
+        except (OSError, ValueError, struct.error):
+            # missing, empty, truncated or from an older release (JSON)
+            index.dirs = {}
+        return index
+
+    def save(self):
+        if not self.dirty:
+            return
+        with self._lock:
+            data = _pack_index(self.dirs)
+        if write_cache_file(self.cache_path, data):
+            self.dirty = False
+
+    def abspath(self, rel_path):
+        return os.path.join(self.root, rel_path) if rel_path else self.root
+
+    def listdir(self, rel_dir="", executor=None):
+        """Return ``(files, dirs)`` of ``rel_dir``, rescanning it only if changed."""
+        cached = self.dirs.get(rel_dir)
+        if cached is not None and not self.validate:
+            return cached["files"], cached["dirs"]
+        return self._revalidate(rel_dir, executor)
+
+    def refresh(self):
+        """Revalidate every known directory against its mtime."""
+        for rel_dir in list(self.dirs):
+            if rel_dir in self.dirs:
+                self._revalidate(rel_dir)
+
+    def _revalidate(self, rel_dir, executor=None):
+        abs_dir = self.abspath(rel_dir)
+        try:
+            mtime = os.stat(abs_dir).st_mtime_ns
+        except OSError:
+            self.forget(rel_dir)
+            return [], []
+        cached = self.dirs.get(rel_dir)
+        racy = cached is not None and cached["mtime"] >= cached["scanned"] - _RACY_WINDOW_NS
+        if cached is not None and cached["mtime"] == mtime and not racy:
+            return cached["files"], cached["dirs"]
+
+        scanned = time.time_ns()
+        try:
+            files, dirs = scan_dir(abs_dir, executor=executor)
+        except OSError:
+            self.forget(rel_dir)
+            return [], []
+        with self._lock:
+            if cached is None or cached["files"] != files or cached["dirs"] != dirs:
+                self.dirty = True
+                for gone in set(cached["dirs"] if cached else ()) - set(dirs):
+                    self.forget(os.path.join(rel_dir, gone))
+            elif racy and mtime < scanned - _RACY_WINDOW_NS:
+                # Persist that the entry has settled so later loads trust it.
+                self.dirty = True
+            self.dirs[rel_dir] = {
+                "mtime": mtime,
+                "scanned": scanned,
+                "files": files,
+                "dirs": dirs,
+            }
+        return files, dirs
+
+    def update_path(self, rel_path):
+        """Re-stat one path and patch it into its parent's listing.
+
+        Paths whose parent was never listed are skipped, that directory is
+        scanned in full the first time it is asked for.
+        """
+        rel_path = rel_path.strip("/")
+        if not rel_path:
+            return
+        parent, name = os.path.split(rel_path)
+        cached = self.dirs.get(parent)
+        if cached is None or is_internal_file(name):
+            return
+        was_dir = name in cached["dirs"]
+        files = [f for f in cached["files"] if f[0] != name]
+        dirs = [d for d in cached["dirs"] if d != name]
+        abs_path = self.abspath(rel_path)
+        try:
+            if stat.S_ISDIR(os.lstat(abs_path).st_mode):
+                dirs.append(name)
+                dirs.sort()
+            else:
+                st = os.stat(abs_path)
+                if not stat.S_ISDIR(st.st_mode):
+                    files.append(
+                        (name, st.st_size, st.st_ctime, st.st_mtime, st.st_atime)
+                    )
+                    files.sort()
+        except OSError:
+            # removed, the entry is simply not added back
+            pass
+        if was_dir and name not in dirs:
+            self.forget(rel_path)
+        cached["files"] = files
+        cached["dirs"] = dirs
+        self.dirty = True
+
+    def forget(self, rel_dir):
+        """Drop ``rel_dir`` and everything below it from the snapshot."""
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        with self._lock:
+            stale = [d for d in self.dirs if d == rel_dir or d.startswith(prefix)]
+            for d in stale:
+                del self.dirs[d]
+            if stale:
+                self.dirty = True
+
+    def walk(self, rel_dir=""):
+        """Yield ``(rel_dir, files, dirs)`` depth first, in name order."""
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            files, dirs = self.listdir(current)
+            yield current, files, dirs
+            stack.extend(os.path.join(current, d) for d in reversed(dirs))
+
+
+def _pack_index(dirs):
+    """Serialize ``TreeIndex.dirs`` into the binary cache format.
+
+    A header, then int64 columns per directory (mtime, scan time, number of
+    files and of sub directories), int64 sizes and float64 ctime, mtime and
+    atime columns per file, and finally every directory path, file name and
+    sub directory name as NUL separated UTF-8.
+    """
+    rel_dirs = list(dirs)
+    entries = [dirs[d] for d in rel_dirs]
+    rows = [row for entry in entries for row in entry["files"]]
+    sub_dirs = [name for entry in entries for name in entry["dirs"]]
+    columns = list(zip(*rows)) or [(), (), (), (), ()]
+    names, sizes, times = columns[0], columns[1], columns[2:]
+    strings = "\0".join([*rel_dirs, *names, *sub_dirs])
+    return b"".join(
+        [
+            _CACHE_HEADER.pack(_CACHE_MAGIC, CACHE_VERSION, len(rel_dirs), len(rows), len(sub_dirs)),
+            np.array(
+                [
+                    [e["mtime"] for e in entries],
+                    [e["scanned"] for e in entries],
+                    [len(e["files"]) for e in entries],
+                    [len(e["dirs"]) for e in entries],
+                ],
+                dtype="<i8",
+            ).tobytes(),
+            np.array(sizes, dtype="<i8").tobytes(),
+            np.array(times, dtype="<f8").tobytes(),
+            strings.encode("utf-8", "surrogateescape"),
+        ]
+    )
+
+
+def _unpack_index(buffer):
+    magic, version, n_dirs, n_files, n_sub_dirs = _CACHE_HEADER.unpack_from(buffer)
+    if magic != _CACHE_MAGIC or version != CACHE_VERSION:
+        raise ValueError("not a tree cache of this version")
+    dirs_offset = _CACHE_HEADER.size
+    sizes_offset = dirs_offset + 8 * 4 * n_dirs
+    times_offset = sizes_offset + 8 * n_files
+    strings_offset = times_offset + 8 * 3 * n_files
+    strings = buffer[strings_offset:].decode("utf-8", "surrogateescape").split("\0")
+    if len(strings) != max(n_dirs + n_files + n_sub_dirs, 1):
+        raise ValueError("truncated tree cache")
+    rel_dirs = strings[:n_dirs]
+    names = strings[n_dirs:n_dirs + n_files]
+    sub_dirs = strings[n_dirs + n_files:n_dirs + n_files + n_sub_dirs]
+
+    # The columns are views of the mapped file, only their copies outlive it.
+    dir_columns = np.frombuffer(buffer, "<i8", 4 * n_dirs, dirs_offset).reshape(4, n_dirs).tolist()
+    sizes = np.frombuffer(buffer, "<i8", n_files, sizes_offset).tolist()
+    times = np.frombuffer(buffer, "<f8", 3 * n_files, times_offset).reshape(3, n_files).tolist()
+    rows = list(zip(names, sizes, *times))
+    dirs = {}
+    file_start = dir_start = 0
+    for rel_dir, mtime, scanned, n_dir_files, n_dir_dirs in zip(rel_dirs, *dir_columns):
+        dirs[rel_dir] = {
+            "mtime": mtime,
+            "scanned": scanned,
+            "files": rows[file_start:file_start + n_dir_files],
+            "dirs": sub_dirs[dir_start:dir_start + n_dir_dirs],
+        }
+        file_start += n_dir_files
+        dir_start += n_dir_dirs
+    return dirs
+
+
+def split_file_ignores(file_ignores):
+    """Return ``(retain_parent, rules, dir_rules)`` from the ``file_ignores`` argument.
+
+    ``rules`` only ever match file names. Whole directories are skipped
+    only when the dict form names them in ``dir_rules``.
+    """
+    if isinstance(file_ignores, dict):
+        return (
+            file_ignores.get("retain_parent", False),
+            tuple(file_ignores.get("rules") or ()),
+            tuple(file_ignores.get("dir_rules") or ()),
+        )
+    return False, tuple(file_ignores or ()), ()
+
+
+def is_ignored(name, rules, is_dir=False):
+    """Match a base name against ``file_ignores`` rules.
+
+    Regex rules use ``re.match``. String rules keep their historical
+    substring test for files, directory rules need an exact name.
+    """
+    for rule in rules:
+        if isinstance(rule, re.Pattern):
+            if rule.match(name):
+                return True
+        elif isinstance(rule, str):
+            if (name == rule) if is_dir else (name in rule):
+                return True
+    return False
+
+
+class GlobPruner:
+    """Decide whether a directory can hold matches for any glob pattern.
+
+    Patterns are compared segment by segment against the directory path, so
+    ``molecule/*`` never descends anywhere but ``molecule``. A ``**`` segment
+    matches any remaining depth, except hidden directories, as in ``wcmatch``.
+    """
+
+    # ``descend`` results: skip the directory, walk it, or walk it and
+    # everything below it (a ``**`` was reached).
+    SKIP, DESCEND, ANY_DEPTH = 0, 1, 2
+
+    def __init__(self, patterns):
+        self.patterns = [
+            [part for part in pattern.split("/") if part not in ("", ".")]
+            for pattern in patterns
+        ]
+        # Patterns like ``**/*.csv`` only constrain the base name, so a plain
+        # ``fnmatch`` on the name replaces a full path match.
+        self.name_matcher = None
+        if all(len(p) == 2 and p[0] == "**" and "**" not in p[1] for p in self.patterns):
+            self.name_matcher = fnmatch.compile([p[1] for p in self.patterns])
+
+    def descend(self, parts):
+        result = self.SKIP
+        for pattern in self.patterns:
+            result = max(result, self._match_below(parts, pattern))
+            if result == self.ANY_DEPTH:
+                break
+        return result
+
+    def _match_below(self, parts, pattern):
+        for i, part in enumerate(parts):
+            segment = pattern[i] if i < len(pattern) else None
+            if segment == "**":
+                if any(p.startswith(".") for p in parts[i:]):
+                    return self.SKIP
+                return self.ANY_DEPTH
+            # the last segment only ever matches files
+            if i >= len(pattern) - 1 or not fnmatch.fnmatch(part, segment):
+                return self.SKIP
+        return self.DESCEND
+
+
+class _TreeFilter:
+    """Globs and ignores of one listing, applied entry by entry."""
+
+    def __init__(self, glob_patterns, file_ignores):
+        self.pruner = GlobPruner(glob_patterns)
+        self.name_matcher = self.pruner.name_matcher
+        self.path_matcher = glob.compile(glob_patterns, flags=glob.GLOBSTAR)
+        self.retain_parent, self.rules, self.dir_rules = split_file_ignores(file_ignores)
+        self._walk_states = {"": GlobPruner.DESCEND}
+
+    def state_of(self, rel_dir):
+        """Pruner state of ``rel_dir`` when it is reached without walking."""
+        if not rel_dir:
+            return GlobPruner.DESCEND
+        if self.dir_rules and any(
+            is_ignored(part, self.dir_rules, is_dir=True) for part in rel_dir.split("/")
+        ):
+            return GlobPruner.SKIP
+        return self.pruner.descend(rel_dir.split("/"))
+
+    def ignored(self, name, is_dir=False):
+        rules = self.dir_rules if is_dir else self.rules
+        return bool(rules) and is_ignored(name, rules, is_dir=is_dir)
+
+    def match_file(self, rel_path, name):
+        if self.name_matcher is not None:
+            return self.name_matcher.match(name)
+        return self.path_matcher.match(rel_path)
+
+    def child_state(self, rel_path, name, parent_state):
+        if parent_state == GlobPruner.ANY_DEPTH:
+            return GlobPruner.SKIP if name.startswith(".") else GlobPruner.ANY_DEPTH
+        return self.pruner.descend(rel_path.split("/"))
+
+    def walk_state(self, rel_dir):
+        """State ``walk_tree`` reaches ``rel_dir`` in, derived from its parents'."""
+        state = self._walk_states.get(rel_dir)
+        if state is None:
+            parent, _, name = rel_dir.rpartition("/")
+            state = self.walk_state(parent)
+            if state != GlobPruner.SKIP:
+                if self.ignored(name, is_dir=True):
+                    state = GlobPruner.SKIP
+                else:
+                    state = self.child_state(rel_dir, name, state)
+            self._walk_states[rel_dir] = state
+        return state
+
+
+def _dir_row(abs_dir):
+    stat = os.stat(abs_dir)
+    return ("", stat.st_size, stat.st_ctime, stat.st_mtime, stat.st_atime)
+
+
+def _listdir_func(root, index, executor=None):
+    def listdir(rel_dir):
+        if index is not None:
+            return index.listdir(rel_dir, executor)
+        try:
+            return scan_dir(os.path.join(root, rel_dir), with_stat=False)
+        except OSError:
+            return [], []
+
+    return listdir
+
+
+def _scan_executor(workers):
+    if not workers or workers <= 1:
+        return None
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="st-file-browser-scan")
+
+
+class _DirVisitor:
+    """List one directory and stat its kept files, for ``walk_tree``."""
+
+    def __init__(self, tree_filter, listdir, executor):
+        self.tree_filter = tree_filter
+        self.listdir = listdir
+        self.executor = executor
+
+    def __call__(self, rel_dir, budget):
+        """Return ``(rows, ignored, dirs)`` for at most ``budget`` kept files.
+
+        ``rows`` are the stat rows of the kept files, ``ignored`` counts the
+        ignored files and ``dirs`` are the sub directory names.
+        """
+        entries, dirs = self.listdir(rel_dir)
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        ignored = 0
+        kept = []
+        for entry in entries:
+            name = _entry_name(entry)
+            if self.tree_filter.ignored(name):
+                ignored += 1
+                continue
+            if self.tree_filter.match_file(prefix + name, name):
+                kept.append(entry)
+                if len(kept) >= budget:
+                    break
+        if kept and isinstance(kept[0], os.DirEntry):
+            kept = stat_entries(kept, self.executor)
+        return kept, ignored, dirs
+
+
+def _sub_dirs(tree_filter, rel_dir, dir_state, dirs):
+    """Return ``([(rel_path, state)], ignored)`` of the sub directories to walk."""
+    prefix = f"{rel_dir}/" if rel_dir else ""
+    children = []
+    ignored = 0
+    for d in dirs:
+        if tree_filter.ignored(d, is_dir=True):
+            ignored += 1
+            continue
+        child_state = tree_filter.child_state(prefix + d, d, dir_state)
+        if child_state != GlobPruner.SKIP:
+            children.append((prefix + d, child_state))
+    return children, ignored
+
+
+class _Prefetcher:
+    """Visit directories ahead of a depth first walk on a thread pool.
+
+    A finished visit queues its own sub directories, so whole subtrees are
+    scanned by the time the walk gets there. Such read ahead stops once
+    ``window`` visits are queued or waiting to be taken, which bounds the
+    work wasted when the walk stops at its limit.
+    """
+
+    def __init__(self, executor, window, visit, tree_filter, limit):
+        self.executor = executor
+        self.window = window
+        self.visit = visit
+        self.tree_filter = tree_filter
+        self.limit = limit
+        self.pending = {}
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def submit(self, dirs, ahead=True):
+        """Queue visits of ``dirs``, ``ahead`` ones only while the window has room."""
+        with self._lock:
+            for rel_dir, dir_state in dirs:
+                if self.closed or (ahead and len(self.pending) >= self.window):
+                    break
+                if rel_dir not in self.pending:
+                    self.pending[rel_dir] = self.executor.submit(self._run, rel_dir, dir_state)
+
+    def _run(self, rel_dir, dir_state):
+        result = self.visit(rel_dir, self.limit)
+        self.submit(_sub_dirs(self.tree_filter, rel_dir, dir_state, result[2])[0])
+        return result
+
+    def take(self, rel_dir, budget):
+        with self._lock:
+            future = self.pending.pop(rel_dir, None)
+        if future is None or future.cancel():
+            return self.visit(rel_dir, budget)
+        kept, ignored, dirs = future.result()
+        return kept[:budget], ignored, dirs
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            futures = list(self.pending.values())
+            self.pending.clear()
+        for future in futures:
+            future.cancel()
+
+
+def walk_tree(
+    root,
+    glob_patterns=("**/*",),
+    file_ignores=None,
+    limit=10000,
+    index=None,
+    workers=None,
+    builder=None,
+    start="",
+):
+    """Walk ``root`` once and return the visible entries as a ``Listing``.
+
+    Globs and ignores are applied while walking: ignored or non matching
+    directories are not descended, and only kept files are stat'ed. The walk
+    stops as soon as ``limit`` entries are collected. When ``index`` (a
+    ``TreeIndex``) is given directory listings come from it instead of the
+    file system.
+
+    With ``workers`` above one, directories ahead of the walk are scanned
+    and files stat'ed on a pool of that many threads, so on high latency
+    mounts (NFS, Lustre) the round trips overlap. The result is the same as
+    the sequential walk.
+
+    Entries are collected into ``builder`` when given, a ``ListingBuilder``
+    other threads can take snapshots of while the walk runs. With ``start``
+    only that sub directory of ``root`` is walked, paths stay relative to
+    ``root``.
+    """
+    root = os.path.abspath(root)
+    tree_filter = _TreeFilter(glob_patterns, file_ignores)
+    executor = _scan_executor(workers)
+    visit = _DirVisitor(tree_filter, _listdir_func(root, index, executor), executor)
+    prefetcher = None
+    if executor is not None:
+        prefetcher = _Prefetcher(
+            executor, workers * _PREFETCH_PER_WORKER, visit, tree_filter, limit
+        )
+
+    files = ListingBuilder() if builder is None else builder
+    start = start.strip("/")
+    start_state = tree_filter.walk_state(start)
+    stack = [(start, start_state)] if start_state != GlobPruner.SKIP else []
+    try:
+        while stack and len(files) < limit:
+            rel_dir, dir_state = stack.pop()
+            budget = limit - len(files)
+            if prefetcher is not None:
+                kept, ignored, dirs = prefetcher.take(rel_dir, budget)
+            else:
+                kept, ignored, dirs = visit(rel_dir, budget)
+            if kept:
+                files.add_rows(files.add_dir(rel_dir), kept)
+            if len(files) >= limit:
+                break
+
+            children, ignored_dirs = _sub_dirs(tree_filter, rel_dir, dir_state, dirs)
+            stack.extend(reversed(children))
+            if prefetcher is not None:
+                # the top of the stack is walked next
+                prefetcher.submit(reversed(stack[-workers:]), ahead=False)
+
+            # Keep a folder whose files were all ignored visible as ``dir/``.
+            if tree_filter.retain_parent and rel_dir and (ignored or ignored_dirs) and not kept:
+                try:
+                    files.add(files.add_dir(rel_dir), _dir_row(os.path.join(root, rel_dir)))
+                except OSError:
+                    continue
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+            # visits still running write into ``index``, let them land
+            executor.shutdown(wait=True)
+    return files.build()
+
+
+def patch_listing(
+    listing,
+    root,
+    glob_patterns=("**/*",),
+    file_ignores=None,
+    limit=10000,
+    removed=(),
+    added=(),
+    workers=None,
+):
+    """Bring a ``walk_tree`` listing up to date after files were changed.
+
+    Entries at or under the ``removed`` and ``added`` paths are dropped,
+    then the ``added`` paths are walked again, so a change costs a walk of
+    what changed instead of the whole tree. New entries come last. Returns
+    ``None`` when only a new walk gives the right listing: the listing was
+    cut at ``limit`` or would be now, or ignore rules keep otherwise empty
+    folders visible.
+    """
+    root = os.path.abspath(root)
+    tree_filter = _TreeFilter(glob_patterns, file_ignores)
+    if tree_filter.retain_parent or len(listing) >= limit:
+        return None
+
+    removed = {path.strip("/") for path in removed}
+    added = {path.strip("/") for path in added}
+    touched = removed | added
+
+    def under_touched(prefix):
+        parts = prefix.rstrip("/").split("/")
+        return any("/".join(parts[: i + 1]) in touched for i in range(len(parts)))
+
+    # per directory prefix first, a listing has far fewer of them than files
+    dropped_dirs = np.array([bool(d) and under_touched(d) for d in listing.dirs], dtype=bool)
+    keep = ~(
+        dropped_dirs[listing.dir_ids]
+        | np.fromiter((path in touched for path in listing.paths()), dtype=bool, count=len(listing))
+    )
+    parts = [listing if keep.all() else listing.take(keep)]
+    budget = limit - len(parts[0])
+
+    files = ListingBuilder()
+    dir_ids = {}
+    for rel_path in sorted(added):
+        # a walk of the parent covers its children
+        if any(rel_path.startswith(f"{other}/") for other in added):
+            continue
+        parent, _, name = rel_path.rpartition("/")
+        if tree_filter.walk_state(parent) == GlobPruner.SKIP:
+            continue
+        abs_path = os.path.join(root, rel_path)
+        if os.path.isdir(abs_path):
+            walked = walk_tree(
+                root, glob_patterns, file_ignores, budget + 1, workers=workers, start=rel_path
+            )
+            budget -= len(walked)
+            parts.append(walked)
+        elif not tree_filter.ignored(name) and tree_filter.match_file(rel_path, name):
+            try:
+                stat = os.stat(abs_path)
+            except OSError:
+                continue
+            dir_id = dir_ids.get(parent)
+            if dir_id is None:
+                dir_id = dir_ids[parent] = files.add_dir(parent)
+            files.add(
+                dir_id,
+                (name, stat.st_size, stat.st_ctime, stat.st_mtime, stat.st_atime),
+            )
+            budget -= 1
+        if budget < 0:
+            return None
+    parts.append(files.build())
+    return Listing.concat(parts)
+
+
+def list_dir(
+    root,
+    rel_dir="",
+    glob_patterns=("**/*",),
+    file_ignores=None,
+    limit=10000,
+    index=None,
+    workers=None,
+):
+    """List the visible children of one directory, for lazy browsing.
+
+    Files are filtered like ``walk_tree``. Sub directories that can hold
+    matches are returned as ``dir/`` entries without being walked.
+    ``workers`` threads stat the files of a large directory.
+    """
+    root = os.path.abspath(root)
+    rel_dir = rel_dir.strip("/")
+    tree_filter = _TreeFilter(glob_patterns, file_ignores)
+    dir_state = tree_filter.state_of(rel_dir)
+    if dir_state == GlobPruner.SKIP:
+        return []
+    executor = _scan_executor(workers)
+    try:
+        visit = _DirVisitor(tree_filter, _listdir_func(root, index, executor), executor)
+        kept, _, dirs = visit(rel_dir, limit)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    prefix = f"{rel_dir}/" if rel_dir else ""
+
+    children = []
+    for d in dirs:
+        if len(children) >= limit:
+            return children
+        rel_path = prefix + d
+        if tree_filter.ignored(d, is_dir=True):
+            continue
+        if tree_filter.child_state(rel_path, d, dir_state) != GlobPruner.SKIP:
+            children.append({"path": f"{rel_path}/", "name": d})
+    children.extend(file_info(prefix + row[0], row) for row in kept[: limit - len(children)])
+    return children
@@ -0,0 +1,117 @@
+import os
+import threading
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is optional, fall back to polling
+    FileSystemEventHandler = object
+    Observer = None
+
+from .cache import shared_listing_cache
+from .tree import TreeIndex, is_internal_file
+
+
+class _IndexEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "deleted", "modified", "moved"):
+            return
+        # A directory's own modified event only says its children changed,
+        # those arrive as events of their own.
+        if event.event_type == "modified" and event.is_directory:
+            return
+        paths = [event.src_path]
+        if event.event_type == "moved":
+            paths.append(event.dest_path)
+        self.watcher.apply(paths)
+
+
+class TreeWatcher:
+    """Keep an in memory ``TreeIndex`` of ``root`` current without rewalking.
+
+    With ``watchdog`` installed, create, delete, move and modify events are
+    patched into the index as they arrive (inotify on Linux). Otherwise, or
+    with ``poll_interval`` set, a background thread revalidates directory
+    mtimes every ``poll_interval`` seconds. Directories are scanned the first
+    time a listing asks for them.
+    """
+
+    def __init__(self, root, poll_interval=None):
+        self.root = os.path.abspath(root)
+        self.index = TreeIndex(self.root, validate=False)
+        self.lock = threading.RLock()
+        self.poll_interval = poll_interval
+        self._observer = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if Observer is not None and self.poll_interval is None:
+            self._observer = Observer()
+            self._observer.schedule(_IndexEventHandler(self), self.root, recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+        else:
+            thread = threading.Thread(
+                target=self._poll,
+                name=f"st-file-browser-poll:{self.root}",
+                daemon=True,
+            )
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def apply(self, abs_paths):
+        # saves of our own caches and upload chunks change nothing listed,
+        # acting on them would invalidate the caches in a loop
+        abs_paths = [
+            path
+            for path in map(os.fsdecode, abs_paths)
+            if not is_internal_file(os.path.basename(path))
+        ]
+        with self.lock:
+            for abs_path in abs_paths:
+                rel_path = os.path.relpath(abs_path, self.root)
+                if not rel_path.startswith(".."):
+                    self.index.update_path(rel_path)
+        for abs_path in abs_paths:
+            shared_listing_cache.invalidate(abs_path)
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval or 2.0):
+            with self.lock:
+                self.index.dirty = False
+                self.index.refresh()
+                changed = self.index.dirty
+            if changed:
+                shared_listing_cache.invalidate(self.root)
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def watch_tree(root, poll_interval=None):
+    """Return the process wide watcher of ``root``, starting it if needed."""
+    root = os.path.abspath(root)
+    with _watchers_lock:
+        watcher = _watchers.get(root)
+        if watcher is None:
+            watcher = _watchers[root] = TreeWatcher(root, poll_interval).start()
+        return watcher
+
+
+def stop_watching(root=None):
+    """Stop the watcher of ``root``, or every watcher."""
+    with _watchers_lock:
+        roots = list(_watchers) if root is None else [os.path.abspath(root)]
+        for r in roots:
+            watcher = _watchers.pop(r, None)
+            if watcher is not None:
+                watcher.stop()
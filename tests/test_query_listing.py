@@ -0,0 +1,24 @@
+from streamlit_file_browser import _query_listing
+from streamlit_file_browser.listing import Listing
+
+
+def _listing(n):
+    return Listing.from_dicts([{"path": f"dir/f{i:02d}.txt", "size": i} for i in range(n)])
+
+
+def test_callable_sort_is_applied_before_paging():
+    def by_size_descending(files):
+        return sorted(files, key=lambda f: f["size"], reverse=True)
+
+    files, page = _query_listing(_listing(30), None, by_size_descending, None, None, 5)
+
+    assert [f["size"] for f in files.to_dicts()] == [29, 28, 27, 26, 25]
+    assert page["loaded"] == 5
+    assert page["total"] == 30
+
+
+def test_callable_sort_without_paging_keeps_all_rows():
+    files, page = _query_listing(_listing(10), None, lambda files: files[::-1], None, None, None)
+
+    assert [f["size"] for f in files.to_dicts()] == list(range(9, -1, -1))
+    assert page is None